@@ -0,0 +1,113 @@
+"""
+PediSafe Age Bands
+Bandas etarias de TRIAGE_RULES["age_thresholds"] para etiquetar chunks en la ingesta
+y filtrar la recuperación por la edad extraída del mensaje
+"""
+
+import math
+import re
+from typing import List, Optional, Tuple
+
+from config import TRIAGE_RULES
+
+# Bandas en el orden de TRIAGE_RULES ("0-3_months", "3-6_months", ...), leídas al arrancar: las
+# etiquetas de los chunks quedan en el índice, no siguen la recarga en caliente de triage.py
+AGE_BANDS = tuple(TRIAGE_RULES["age_thresholds"])
+
+
+def band_range(band: str) -> Tuple[float, float]:
+    """Rango [desde, hasta) en meses del nombre de la banda: "3-6_months" -> (3, 6), "over_12_months" -> (12, inf)"""
+    bounds = re.findall(r"\d+", band)
+    if band.startswith("over"):
+        return float(bounds[0]), math.inf
+    return float(bounds[0]), float(bounds[1])
+
+
+_BAND_RANGES = {band: band_range(band) for band in AGE_BANDS}
+
+_UNIT = r"(months?|meses|mes|weeks?|semanas?|years?|años?)"
+_UNIT_MONTHS = (("mes", 1), ("month", 1), ("semana", 0.25), ("week", 0.25), ("año", 12), ("year", 12))
+
+# Menciones de edad en guías: "under 3 months", "0-3 months", "3 to 6 months", "over 12 months"
+_AGE_PATTERNS = [
+    (re.compile(rf"(?:under|younger than|less than|menos de|menores de)\s+(\d+)\s*{_UNIT}"), "under"),
+    (re.compile(rf"(\d+)\s*(?:-|–|to|a)\s*(\d+)\s*{_UNIT}"), "range"),
+    (re.compile(rf"(?:over|older than|more than|mayores de|más de)\s+(\d+)\s*{_UNIT}"), "over"),
+]
+
+_HEADING_RE = re.compile(r"^#{1,4}\s+(.+)$", re.MULTILINE)
+# Secciones de emergencia / señales de alarma: aplican a cualquier edad aunque nombren una
+_EMERGENCY_HEADING_RE = re.compile(
+    r"emergen|urgent|urgencia|red flag|warning sign|señales de alarma|call 911|call 999|a&e|\ber\b",
+    re.IGNORECASE,
+)
+
+
+def _months(value: str, unit: str) -> float:
+    for prefix, factor in _UNIT_MONTHS:
+        if unit.startswith(prefix):
+            return float(value) * factor
+    return float(value)
+
+
+def _mentioned_ranges(text: str) -> List[Tuple[float, float]]:
+    ranges = []
+    text = text.lower()
+    for pattern, kind in _AGE_PATTERNS:
+        for match in pattern.finditer(text):
+            if kind == "under":
+                ranges.append((0, _months(match.group(1), match.group(2))))
+            elif kind == "range":
+                ranges.append((_months(match.group(1), match.group(3)), _months(match.group(2), match.group(3))))
+            else:
+                ranges.append((_months(match.group(1), match.group(2)), math.inf))
+    return ranges
+
+
+def tag_age_bands(text: str) -> List[str]:
+    """Bandas que menciona el texto; [] = contenido general (aplica a cualquier edad)"""
+    bands = set()
+    for low, high in _mentioned_ranges(text):
+        for band, (band_low, band_high) in _BAND_RANGES.items():
+            if low < band_high and band_low < high:
+                bands.add(band)
+    return [band for band in AGE_BANDS if band in bands]
+
+
+def chunk_age_bands(section: str, content: str) -> List[str]:
+    """Bandas de un chunk según sus encabezados (jerarquía de la sección + los que contiene)
+    
+    El cuerpo no cuenta: "menores de 3 meses" dentro de una lista de signos de alarma no
+    hace que el chunk sea solo para bebés. Los chunks de secciones de emergencia son
+    generales, así el filtro por edad nunca los descarta.
+    """
+    headings = [section, *_HEADING_RE.findall(content)]
+    if any(_EMERGENCY_HEADING_RE.search(heading) for heading in headings):
+        return []
+    return tag_age_bands("\n".join(headings))
+
+
+def section_heading(document: str, position: int) -> str:
+    """Último encabezado markdown antes de `position` (el splitter pierde la jerarquía)"""
+    heading = ""
+    for match in _HEADING_RE.finditer(document):
+        if match.start() > position:
+            break
+        heading = match.group(1)
+    return heading
+
+
+def age_band_for(age_months: Optional[float]) -> Optional[str]:
+    """Banda de TRIAGE_RULES para una edad en meses"""
+    if age_months is None:
+        return None
+    for band in AGE_BANDS:
+        low, high = _BAND_RANGES[band]
+        if low <= age_months < high:
+            return band
+    return None
+
+
+def band_mask(bands: List[str]) -> int:
+    """Bits de las bandas de un chunk (0 = general)"""
+    return sum(1 << AGE_BANDS.index(band) for band in bands if band in AGE_BANDS)
@@ -0,0 +1,163 @@
+"""
+PediSafe ANN Index
+Tipos de índice FAISS seleccionables (flat, IVF, HNSW, PQ) y almacenamiento compacto
+(float16 / int8) construidos sobre los vectores del índice plano
+"""
+
+import math
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import faiss
+import numpy as np
+
+ANN_INDEX_TYPES = ("flat", "ivf", "hnsw", "pq", "ivfpq")
+
+# Codec de los vectores almacenados: float32 (4 B/dim), float16 (2 B/dim), int8 escalar (1 B/dim)
+VECTOR_STORAGES = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}
+
+# Mapeo de los códigos de índices planos (faiss >= 1.9); sin él mmap solo cubre listas IVF
+IO_FLAG_MMAP_IFC = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+_warned_no_mmap_ifc = False
+
+# k-means necesita al menos tantos puntos como centroides; FAISS recomienda ~39 por centroide
+MIN_POINTS_PER_CENTROID = 39
+PQ_CENTROIDS = 256  # 8 bits por subcuantizador
+
+
+def _auto_nlist(n: int) -> int:
+    return max(1, min(int(4 * math.sqrt(n)), n // MIN_POINTS_PER_CENTROID))
+
+
+def _auto_pq_m(d: int) -> int:
+    # ~8 dimensiones por subcuantizador: 384-d -> 48 bytes/vector, 1536-d -> 192 bytes/vector
+    m = max(1, d // 8)
+    while d % m:
+        m -= 1
+    return m
+
+
+def index_factory_string(index_type: str, n: int, d: int, params: dict, storage: str = "float32") -> Optional[str]:
+    """Descripción index_factory para `index_type` + `storage`
+    
+    None si basta el índice plano float32, o si el corpus es muy chico para entrenarlo.
+    PQ ya comprime los vectores, así que ignora `storage`.
+    """
+    if index_type not in ANN_INDEX_TYPES:
+        raise ValueError(f"Tipo de índice desconocido: {index_type} (opciones: {', '.join(ANN_INDEX_TYPES)})")
+    if storage not in VECTOR_STORAGES:
+        raise ValueError(f"Almacenamiento desconocido: {storage} (opciones: {', '.join(VECTOR_STORAGES)})")
+    codec = VECTOR_STORAGES[storage]
+    nlist = params.get("nlist") or _auto_nlist(n)
+    pq_m = params.get("pq_m") or _auto_pq_m(d)
+    
+    if index_type == "flat":
+        return None if codec == "Flat" else codec
+    if index_type == "hnsw":
+        hnsw = f"HNSW{params.get('hnsw_m', 32)}"
+        return hnsw if codec == "Flat" else f"{hnsw},{codec}"
+    if index_type in ("ivf", "ivfpq") and (nlist < 2 or n < nlist * MIN_POINTS_PER_CENTROID):
+        return None
+    if index_type in ("pq", "ivfpq") and (d % pq_m or n < PQ_CENTROIDS):
+        return None
+    if index_type == "ivf":
+        return f"IVF{nlist},{codec}"
+    # "np": sin entrenamiento polisémico (muy lento y solo útil con búsqueda Hamming)
+    if index_type == "pq":
+        return f"PQ{pq_m}np"
+    return f"IVF{nlist},PQ{pq_m}np"
+
+
+def is_lossy(index_type: str, storage: str) -> bool:
+    """True si el índice servido no guarda los vectores float32 exactos"""
+    return storage != "float32" or index_type in ("pq", "ivfpq")
+
+
+def build_ann_index(vectors: np.ndarray, index_type: str, params: dict,
+                    storage: str = "float32") -> Optional[faiss.Index]:
+    """Entrena y llena un índice aproximado con `vectors` (mismo orden de ids que el índice plano)"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, d = vectors.shape
+    description = index_factory_string(index_type, n, d, params, storage)
+    if description is None:
+        return None
+    
+    index = faiss.index_factory(d, description, faiss.METRIC_L2)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = params.get("ef_construction", 80)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    
+    ivf = _ivf(index)
+    if ivf is not None:
+        # MMR de LangChain llama a index.reconstruct() sobre los candidatos
+        ivf.make_direct_map()
+    configure_search(index, params)
+    return index
+
+
+def configure_search(index: faiss.Index, params: dict):
+    """Parámetros de búsqueda (no requieren re-entrenar): nprobe para IVF, efSearch para HNSW"""
+    ivf = _ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(params.get("nprobe", 8), ivf.nlist)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = params.get("ef_search", 64)
+
+
+def with_rescoring(index: faiss.Index, exact: faiss.Index, k_factor: int) -> faiss.Index:
+    """Re-scoring exacto: busca k*k_factor candidatos en `index` y los reordena con `exact`
+    
+    `exact` es el índice plano float32 (idealmente mmap): solo se leen las filas de los
+    candidatos, así que los vectores completos no necesitan estar residentes en RAM.
+    reconstruct() también devuelve los vectores exactos (los usa el MMR de LangChain).
+    """
+    if k_factor <= 1:
+        return index
+    refined = faiss.IndexRefine(index, exact)
+    refined.k_factor = k_factor
+    refined.referenced_objects = [index, exact]  # SWIG no toma ownership de los índices
+    return refined
+
+
+def _ivf(index: faiss.Index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def index_vectors(index: faiss.Index) -> np.ndarray:
+    """Vectores completos de un índice plano (fuente para construir los aproximados)"""
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def read_index(path: Path, mmap: bool = False) -> faiss.Index:
+    """Lee un índice; con mmap=True las páginas se comparten entre procesos (solo lectura)"""
+    global _warned_no_mmap_ifc
+    if not mmap:
+        return faiss.read_index(str(path))
+    # IO_FLAG_MMAP cubre listas invertidas (IVF); IO_FLAG_MMAP_IFC los códigos planos (faiss >= 1.9)
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    if IO_FLAG_MMAP_IFC is not None:
+        flags |= IO_FLAG_MMAP_IFC
+    elif not _warned_no_mmap_ifc:
+        _warned_no_mmap_ifc = True
+        print(f"⚠️ faiss {faiss.__version__} no soporta mmap de índices planos (requiere faiss >= 1.9): "
+              f"cada proceso carga su propia copia en memoria")
+    return faiss.read_index(str(path), flags)
+
+
+def write_index(index: faiss.Index, path: Path):
+    """Escribe el índice de forma atómica (tmp + os.replace en el mismo directorio)"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".faiss")
+    os.close(fd)
+    try:
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
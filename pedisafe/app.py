@@ -12,8 +12,9 @@ import streamlit.components.v1 as components
 import os
 from pathlib import Path
 
-from config import get_ui_config, get_triage_levels, TRIAGE_RULES
-from rag_engine import PediSafeRAG
+from config import get_ui_config, get_triage_levels, TRIAGE_RULES, RAG_CONFIG
+from knowledge_index import warm_up_shared_index
+from rag_engine import get_shared_engine
 from i18n import get_text
 
 def init_session_state():
@@ -214,7 +215,6 @@ def render_language_selector_sidebar(lang: str):
     new_lang = lang_options[selected_lang]
     if new_lang != st.session_state.language:
         st.session_state.language = new_lang
-        st.session_state.rag_engine = None
         st.rerun()
 
 def render_triage_legend_sidebar(lang: str):
@@ -640,6 +640,11 @@ def main():
     api_key, provider = get_api_key(lang)
     st.sidebar.divider()
     
+    # Load embeddings model + FAISS index in the background while the rest of the UI renders
+    knowledge_path = Path(__file__).parent / "knowledge"
+    if RAG_CONFIG["background_warmup"] and (api_key or provider == "cerebras"):
+        warm_up_shared_index(str(knowledge_path), provider, api_key or "")
+    
     # Rest of sidebar
     render_sidebar(lang)
     
@@ -657,12 +662,13 @@ def main():
             st.markdown(get_text("example_assistant", lang))
         return
     
-    # Initialize RAG engine if needed or if provider changed
-    if st.session_state.rag_engine is None or (hasattr(st.session_state.rag_engine, 'provider') and st.session_state.rag_engine.provider != provider):
+    # Attach the process-wide shared RAG engine if needed or if provider/language/key changed
+    # The session only keeps a reference: model and FAISS index are loaded once per process
+    engine = st.session_state.rag_engine
+    if engine is None or (engine.provider, engine.language, engine.api_key) != (provider, lang, api_key):
         with st.spinner(f"🔄 {get_text('loading_knowledge', lang)}"):
             try:
-                knowledge_path = Path(__file__).parent / "knowledge"
-                st.session_state.rag_engine = PediSafeRAG(api_key, str(knowledge_path), lang, provider)
+                st.session_state.rag_engine = get_shared_engine(api_key, str(knowledge_path), lang, provider)
             except Exception as e:
                 handle_api_error(e, lang)
                 return
@@ -691,10 +697,21 @@ def main():
             with st.spinner(f"{get_text('analyzing', lang)}..."):
                 try:
                     chat_history = get_chat_history()
-                    response = st.session_state.rag_engine.get_response(
-                        prompt, 
-                        chat_history
-                    )
+                    engine = st.session_state.rag_engine
+                    # Red flag determinista: el ROJO se muestra antes de cualquier llamada al LLM
+                    emergency = engine.get_emergency_response(prompt)
+                    if emergency is not None:
+                        st.markdown(emergency)
+                        st.session_state.messages.append({"role": "assistant", "content": emergency})
+                        if not RAG_CONFIG["emergency_fast_path"]["elaborate"]:
+                            return
+                        response = f"{get_text('emergency_elaboration', lang)}\n\n" + \
+                            engine.elaborate_emergency(prompt, chat_history).result()
+                    else:
+                        response = engine.get_response(
+                            prompt, 
+                            chat_history
+                        )
                     st.markdown(response)
                     st.session_state.messages.append({
                         "role": "assistant", 
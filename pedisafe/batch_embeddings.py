@@ -0,0 +1,97 @@
+"""
+PediSafe Batch Embeddings
+Vectorización por lotes (y en paralelo) de chunks durante la ingesta
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+INGESTION_MODES = ("serial", "batched", "parallel")
+
+
+class BatchedEmbeddings(Embeddings):
+    """Vectoriza documentos en lotes explícitos y reporta chunks/seg
+    
+    Modos:
+    - "batched": lotes de `batch_size` en el proceso actual
+    - "parallel": sentence-transformers con un pool multi-proceso (CPU);
+      OpenAI (u otro backend remoto) con peticiones por lote concurrentes
+    Las consultas (embed_query) pasan directo al backend.
+    """
+    
+    def __init__(self, embeddings: Embeddings, mode: str = "batched", batch_size: int = 64, workers: int = 0):
+        if mode not in INGESTION_MODES:
+            raise ValueError(f"Modo de ingesta desconocido: {mode} (opciones: {', '.join(INGESTION_MODES)})")
+        self.embeddings = embeddings
+        self.mode = mode
+        self.batch_size = max(1, batch_size)
+        self.workers = workers or os.cpu_count() or 1
+        self.last_stats = {}
+    
+    def _is_sentence_transformers(self) -> bool:
+        # HuggingFaceEmbeddings expone el SentenceTransformer en .client
+        return hasattr(getattr(self.embeddings, "client", None), "start_multi_process_pool")
+    
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        return [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+    
+    def _encode_local(self, texts: List[str], parallel: bool) -> List[List[float]]:
+        """sentence-transformers: encode por lotes, opcionalmente repartido entre procesos"""
+        model = self.embeddings.client
+        encode_kwargs = dict(getattr(self.embeddings, "encode_kwargs", {}) or {})
+        encode_kwargs.pop("batch_size", None)
+        encode_kwargs.pop("show_progress_bar", None)
+        
+        # Un pool solo compensa si cada worker recibe al menos un lote completo
+        if parallel and self.workers > 1 and len(texts) >= 2 * self.batch_size:
+            pool = model.start_multi_process_pool(target_devices=["cpu"] * self.workers)
+            try:
+                vectors = model.encode_multi_process(
+                    texts, pool, batch_size=self.batch_size,
+                    normalize_embeddings=encode_kwargs.get("normalize_embeddings", False)
+                )
+            finally:
+                model.stop_multi_process_pool(pool)
+        else:
+            vectors = model.encode(texts, batch_size=self.batch_size, **encode_kwargs)
+        return [vector.tolist() for vector in vectors]
+    
+    def _embed_remote(self, texts: List[str], parallel: bool) -> List[List[float]]:
+        """OpenAI u otro backend: un request por lote, concurrentes en modo parallel"""
+        batches = self._batches(texts)
+        if parallel and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(batches))) as pool:
+                results = list(pool.map(self.embeddings.embed_documents, batches))
+        else:
+            results = [self.embeddings.embed_documents(batch) for batch in batches]
+        return [vector for batch in results for vector in batch]
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        
+        start = time.perf_counter()
+        if self.mode == "serial":
+            vectors = self.embeddings.embed_documents(texts)
+        elif self._is_sentence_transformers():
+            vectors = self._encode_local(texts, parallel=self.mode == "parallel")
+        else:
+            vectors = self._embed_remote(texts, parallel=self.mode == "parallel")
+        elapsed = time.perf_counter() - start
+        
+        self.last_stats = {
+            "mode": self.mode,
+            "chunks": len(texts),
+            "seconds": round(elapsed, 3),
+            "chunks_per_sec": round(len(texts) / elapsed, 1) if elapsed > 0 else float("inf"),
+        }
+        print(f"🧮 {len(texts)} chunks vectorizados en {elapsed:.2f}s "
+              f"({self.last_stats['chunks_per_sec']} chunks/s, modo {self.mode})")
+        return vectors
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
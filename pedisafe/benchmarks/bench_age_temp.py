@@ -0,0 +1,87 @@
+"""
+Benchmark: extracción de edad y temperatura por mensaje, implementación anterior
+(hasta 13 re.search con patrones sin precompilar, primer acierto) frente al scanner
+de una pasada de triage.scan_mentions / extract_age_temp
+
+Uso:
+    python benchmarks/bench_age_temp.py [--messages 20000]
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from triage import extract_age_temp  # noqa: E402
+
+_MESSAGES = (
+    "Mi bebé de 2 meses tiene 38.5°C desde la mañana",
+    "My 8 month old has a temperature of 39.2 C and won't eat",
+    "hijo de 3 años con tos y mocos hace 2 semanas, sin fiebre",
+    "2-month-old with temp 101 F, should I go to the ER?",
+    "¿Cuánto paracetamol le doy a un niño de 15 kilos?",
+    "She is 18 months and has had diarrhea since yesterday, drinking fine",
+)
+
+
+def legacy_extract(message: str) -> dict:
+    """Copia de PediSafeRAG._extract_age_temp antes del scanner compilado"""
+    result = {"age_months": None, "temp_c": None}
+    message_lower = message.lower()
+    age_patterns = [
+        (r"(\d+)\s*meses?", 1), (r"(\d+)\s*months?", 1), (r"(\d+)\s*años?", 12), (r"(\d+)\s*years?", 12),
+        (r"(\d+)\s*semanas?", 0.25), (r"(\d+)\s*weeks?", 0.25), (r"bebé?\s*de\s*(\d+)", 1),
+        (r"(\d+)[-\s]?(month|mes)", 1),
+    ]
+    for pattern, multiplier in age_patterns:
+        match = re.search(pattern, message_lower)
+        if match:
+            result["age_months"] = int(float(match.group(1)) * multiplier)
+            break
+    temp_patterns = [
+        r"(\d+\.?\d*)\s*°?\s*[cC](?:\s|,|$)", r"(\d+\.?\d*)\s*grados", r"temperatura\s*:?\s*(\d+\.?\d*)",
+        r"(\d+\.?\d*)\s*°?\s*[fF]", r"temp\w*\s*:?\s*(\d+\.?\d*)",
+    ]
+    for pattern in temp_patterns:
+        match = re.search(pattern, message_lower)
+        if match:
+            temp = float(match.group(1))
+            if temp > 45 or 'f' in pattern.lower():
+                temp = (temp - 32) * 5 / 9
+            result["temp_c"] = round(temp, 1)
+            break
+    return result
+
+
+def per_call_us(extract, messages: list) -> float:
+    start = time.perf_counter()
+    for message in messages:
+        extract(message)
+    return (time.perf_counter() - start) * 1e6 / len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+    
+    rng = random.Random(0)
+    messages = [rng.choice(_MESSAGES) for _ in range(args.messages)]
+    per_call_us(legacy_extract, messages[:500])  # Calentamiento
+    per_call_us(extract_age_temp, messages[:500])
+    
+    legacy = per_call_us(legacy_extract, messages)
+    scanner = per_call_us(extract_age_temp, messages)
+    print(f"{'camino':<22} {'µs/mensaje':>10} {'mensajes/s':>12}")
+    print(f"{'re.search en cascada':<22} {legacy:>10.2f} {1e6 / legacy:>12,.0f}")
+    print(f"{'scanner compilado':<22} {scanner:>10.2f} {1e6 / scanner:>12,.0f}   x{legacy / scanner:.1f}")
+    for message in _MESSAGES:
+        print(f"  {message[:48]:<48} {legacy_extract(message)} -> {extract_age_temp(message)}")
+
+
+if __name__ == "__main__":
+    main()
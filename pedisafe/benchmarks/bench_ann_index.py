@@ -0,0 +1,134 @@
+"""
+Benchmark: recall@k y latencia p50/p99 de los tipos de índice FAISS y del almacenamiento
+compacto (float16 / int8, con y sin re-scoring) frente al índice plano float32 (exacto)
+
+Por defecto usa vectores sintéticos agrupados (simulan chunks de guías clínicas) a varios
+tamaños de corpus; con --snapshot usa los vectores reales de un índice guardado.
+Las consultas se hacen de a una, como en get_response.
+
+Uso:
+    python benchmarks/bench_ann_index.py [--sizes 1000 10000 100000] [--dim 384] [--k 6]
+    python benchmarks/bench_ann_index.py --snapshot faiss_index/<settings>/<snapshot>
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ann_index import ANN_INDEX_TYPES, build_ann_index, index_vectors, is_lossy, with_rescoring  # noqa: E402
+from config import RAG_CONFIG  # noqa: E402
+
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Vectores normalizados agrupados en ~sqrt(n) temas"""
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(max(8, int(np.sqrt(n))), dim))
+    vectors = topics[rng.integers(0, len(topics), n)] + 0.35 * rng.normal(size=(n, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def make_queries(vectors: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """Consultas cercanas (pero no iguales) a chunks del corpus"""
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.integers(0, len(vectors), count)]
+    queries = picked + 0.1 * rng.normal(size=picked.shape)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries.astype(np.float32)
+
+
+def index_bytes(index: faiss.Index) -> int:
+    return int(faiss.serialize_index(index).size)
+
+
+def bench(index: faiss.Index, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    """Latencia por consulta individual y recall@k contra la verdad del índice plano"""
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(ids[0]) & set(expected))
+    latencies.sort()
+    return {
+        "recall": hits / (len(queries) * k),
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))],
+    }
+
+
+def load_ms(index: faiss.Index) -> float:
+    """Tiempo de carga del índice serializado (proxy del arranque en frío)"""
+    data = faiss.serialize_index(index)
+    start = time.perf_counter()
+    faiss.deserialize_index(data)
+    return (time.perf_counter() - start) * 1000
+
+
+def run(vectors: np.ndarray, queries: np.ndarray, k: int, params: dict, rescore_factor: int):
+    n, dim = vectors.shape
+    flat = faiss.IndexFlatL2(dim)
+    flat.add(vectors)
+    _, truth = flat.search(queries, k)
+    
+    print(f"\nCorpus: {n} vectores x {dim}-d, {len(queries)} consultas, k={k}")
+    print(f"{'index':<7} {'storage':<16} {'build s':>8} {'MB':>8} {'load ms':>8} "
+          f"{'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    
+    def report(index_type, storage, build, rescore=False):
+        start = time.perf_counter()
+        index = flat if build is None else build()
+        build_s = time.perf_counter() - start
+        if index is None:
+            print(f"{index_type:<7} {storage:<16} (corpus muy chico)")
+            return
+        # Memoria / carga: solo el índice servido (el plano de re-scoring queda en mmap)
+        size, load = index_bytes(index), load_ms(index)
+        if rescore:
+            index = with_rescoring(index, flat, rescore_factor)
+            storage += f"+rescore{rescore_factor}"
+        result = bench(index, queries, truth, k)
+        print(f"{index_type:<7} {storage:<16} {build_s:>8.2f} {size / 1e6:>8.1f} {load:>8.2f} "
+              f"{result['recall']:>9.3f} {result['p50']:>8.3f} {result['p99']:>8.3f}")
+    
+    for index_type in ANN_INDEX_TYPES:
+        storage = "pq" if is_lossy(index_type, "float32") else "float32"
+        build = None if index_type == "flat" else (lambda t=index_type: build_ann_index(vectors, t, params))
+        report(index_type, storage, build)
+    
+    # Almacenamiento compacto del índice exacto, con y sin re-scoring de candidatos
+    for storage in ("float16", "int8"):
+        for rescore in (False, True):
+            report("flat", storage, lambda s=storage: build_ann_index(vectors, "flat", params, s), rescore)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=384, help="384 = MiniLM, 1536 = text-embedding-3-small")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--rescore-factor", type=int, default=RAG_CONFIG["rescore_factor"])
+    parser.add_argument("--snapshot", help="Directorio de snapshot con index.faiss (vectores reales)")
+    args = parser.parse_args()
+    
+    faiss.omp_set_num_threads(1)  # Latencia de una consulta en un worker, sin paralelismo intra-query
+    params = RAG_CONFIG["index_params"]
+    if args.snapshot:
+        vectors = index_vectors(faiss.read_index(str(Path(args.snapshot) / "index.faiss")))
+        run(vectors, make_queries(vectors, args.queries), args.k, params, args.rescore_factor)
+        return
+    for n in args.sizes:
+        vectors = synthetic_vectors(n, args.dim)
+        run(vectors, make_queries(vectors, args.queries), args.k, params, args.rescore_factor)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Benchmark: pre-triage determinista de mensajes históricos con triage.classify_batch
+(sin LLM ni embeddings); reporta mensajes por minuto y la distribución de niveles
+
+Uso:
+    python benchmarks/bench_classify_batch.py [--sizes 10000 50000]
+"""
+
+import argparse
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from triage import classify_batch  # noqa: E402
+
+_AGES = ("bebé de {n} semanas", "mi hijo de {n} meses", "my {n} month old", "niña de {n} años", "my {n} year old")
+_SYMPTOMS = ("tiene {t}°C", "has a temperature of {t} C", "con fiebre de {t} grados", "tiene tos y mocos",
+             "had a seizure this morning", "no quiere comer", "temp {f} F")
+
+
+def synthetic_messages(count: int, rng: random.Random) -> list:
+    messages = []
+    for _ in range(count):
+        temp = round(rng.uniform(36.5, 40.5), 1)
+        age = rng.choice(_AGES).format(n=rng.randint(1, 11))
+        symptom = rng.choice(_SYMPTOMS).format(t=temp, f=round(temp * 9 / 5 + 32, 1))
+        messages.append(f"Hola, {age} {symptom}, ¿qué hago?")
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    args = parser.parse_args()
+    
+    rng = random.Random(0)
+    classify_batch(synthetic_messages(500, rng))  # Calentamiento (compilación de reglas)
+    print(f"{'mensajes':>9} {'segundos':>9} {'mensajes/min':>13}  niveles")
+    for n in args.sizes:
+        messages = synthetic_messages(n, rng)
+        start = time.perf_counter()
+        levels = classify_batch(messages)
+        elapsed = time.perf_counter() - start
+        counts = Counter(level or "sin decidir" for level in levels)
+        print(f"{n:>9} {elapsed:>9.2f} {n / elapsed * 60:>13,.0f}  {dict(counts)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark: tiempo de import en frío de rag_engine / knowledge_index
+Cada medición corre en un proceso Python nuevo (sin módulos en caché de sys.modules)
+
+Uso:
+    python benchmarks/bench_import_time.py [--runs 7]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+PEDISAFE_DIR = Path(__file__).resolve().parent.parent
+
+SNIPPET = """
+import sys, time
+sys.path.insert(0, {path!r})
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [m for m in ("langchain_openai", "langchain_community", "faiss", "torch", "sentence_transformers")
+         if m in sys.modules]
+print(elapsed, ",".join(heavy))
+"""
+
+
+def measure(module: str, runs: int):
+    """Mide el import de `module` en `runs` procesos nuevos"""
+    timings, heavy = [], ""
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", SNIPPET.format(path=str(PEDISAFE_DIR), module=module)],
+            capture_output=True, text=True, check=True, cwd=str(PEDISAFE_DIR)
+        ).stdout.split()
+        timings.append(float(out[0]) * 1000)
+        heavy = out[1] if len(out) > 1 else "-"
+    return timings, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'module':<18} {'p50 ms':>9} {'min ms':>9} {'max ms':>9}  heavy modules loaded")
+    for module in ("rag_engine", "knowledge_index"):
+        timings, heavy = measure(module, args.runs)
+        print(f"{module:<18} {statistics.median(timings):>9.1f} {min(timings):>9.1f} "
+              f"{max(timings):>9.1f}  {heavy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark: costo por consulta del MMR de langchain (as_retriever(search_type="mmr"))
+frente al MMR vectorizado con NumPy sobre la matriz normalizada cacheada
+
+El embedding de la consulta está precalculado en ambos caminos: solo se mide búsqueda
+FAISS de fetch_k candidatos + selección MMR + lectura del docstore.
+
+Uso:
+    python benchmarks/bench_mmr.py [--sizes 1000 10000 50000] [--dim 384] [--queries 300]
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_ann_index import make_queries, synthetic_vectors  # noqa: E402
+from retrievers import VectorizedMMRRetriever  # noqa: E402
+
+SEARCH_KWARGS = {"k": 6, "fetch_k": 20, "lambda_mult": 0.7}
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """Devuelve el vector ya calculado de cada consulta ("q<i>")"""
+    
+    def __init__(self, queries: np.ndarray):
+        self.queries = queries
+    
+    def embed_query(self, text: str):
+        return self.queries[int(text[1:])].tolist()
+    
+    def embed_documents(self, texts):
+        raise NotImplementedError
+
+
+def build_vectorstore(vectors: np.ndarray, embeddings: Embeddings) -> FAISS:
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    ids = [f"chunk-{i}" for i in range(len(vectors))]
+    docstore = InMemoryDocstore({doc_id: Document(id=doc_id, page_content=doc_id) for doc_id in ids})
+    return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
+
+
+def timed(retriever, count: int) -> tuple:
+    latencies, results = [], []
+    for i in range(count):
+        start = time.perf_counter()
+        docs = retriever.invoke(f"q{i}")
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([doc.id for doc in docs])
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(0.99 * (len(latencies) - 1))], results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--gram-limit", type=int, default=0,
+                        help="Precalcular chunk-chunk hasta este tamaño (0 = bloque por consulta, como config)")
+    args = parser.parse_args()
+    
+    faiss.omp_set_num_threads(1)
+    print(f"{'chunks':>8} {'camino':<22} {'p50 ms':>8} {'p99 ms':>8}")
+    for n in args.sizes:
+        vectors = synthetic_vectors(n, args.dim)
+        queries = make_queries(vectors, args.queries)
+        vectorstore = build_vectorstore(vectors, PrecomputedEmbeddings(queries))
+        
+        gram = vectors @ vectors.T if n <= args.gram_limit else None
+        vectorized = VectorizedMMRRetriever(vectorstore=vectorstore, vectors=vectors, gram=gram, **SEARCH_KWARGS)
+        langchain = vectorstore.as_retriever(search_type="mmr", search_kwargs=SEARCH_KWARGS)
+        
+        # Calentamiento (imports y cachés de CPU)
+        timed(langchain, 10)
+        timed(vectorized, 10)
+        
+        base_p50, base_p99, expected = timed(langchain, args.queries)
+        fast_p50, fast_p99, got = timed(vectorized, args.queries)
+        label = "numpy" + (" + gram" if gram is not None else "")
+        print(f"{n:>8} {'langchain mmr':<22} {base_p50:>8.3f} {base_p99:>8.3f}")
+        print(f"{n:>8} {label:<22} {fast_p50:>8.3f} {fast_p99:>8.3f}   "
+              f"x{base_p50 / fast_p50:.1f}, misma selección: {expected == got}")
+
+
+if __name__ == "__main__":
+    main()
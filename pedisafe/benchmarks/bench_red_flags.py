@@ -0,0 +1,107 @@
+"""
+Benchmark: costo por mensaje de la búsqueda de señales de alarma de la Capa A
+con 10/100/1000 reglas: bucle `flag in mensaje` (implementación anterior), una
+alternación regex plana y el matcher compilado como trie (triage.RedFlagMatcher)
+
+Las reglas sintéticas imitan sinónimos multilingües: frases de 1-3 palabras que
+comparten prefijos ("dificultad para...", "no ..."). Los mensajes son consultas de
+padres de ~200 caracteres; una de cada cuatro contiene una señal.
+
+Uso:
+    python benchmarks/bench_red_flags.py [--sizes 10 100 1000] [--messages 2000]
+"""
+
+import argparse
+import random
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import TRIAGE_RULES  # noqa: E402
+from triage import RedFlagMatcher  # noqa: E402
+
+_WORDS = ("dificultad", "para", "respirar", "no", "responde", "piel", "manchas", "rigidez", "cuello",
+          "breathing", "blue", "spots", "stiff", "vomita", "sangre", "labios", "morados", "letargo",
+          "llanto", "inconsolable", "rash", "purple", "fontanela", "hundida", "deshidratación", "grave")
+_FILLER = ("mi bebé de 8 meses tiene fiebre de 38.5 desde ayer, come poco y duerme mucho. "
+           "my toddler has had a runny nose and a mild cough for three days, should i worry? ")
+
+
+def synthetic_flags(n: int, rng: random.Random) -> list:
+    flags = list(dict.fromkeys(TRIAGE_RULES["red_flags"]))[:n]
+    while len(flags) < n:
+        phrase = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 3))) + f" {len(flags)}"
+        flags.append(phrase)
+    return flags
+
+
+def synthetic_messages(flags: list, count: int, rng: random.Random) -> list:
+    messages = []
+    for i in range(count):
+        start = rng.randrange(len(_FILLER) // 2)
+        text = _FILLER[start:start + 200]
+        if i % 4 == 0:
+            cut = rng.randrange(len(text))
+            text = text[:cut] + " " + rng.choice(flags) + " " + text[cut:]
+        messages.append(text)
+    return messages
+
+
+def loop_first(flags: list, message: str):
+    message_lower = message.lower()
+    for flag in flags:
+        if flag.lower() in message_lower:
+            return flag
+    return None
+
+
+def timed(check, messages: list) -> tuple:
+    latencies, found = [], []
+    for message in messages:
+        start = time.perf_counter()
+        result = check(message)
+        latencies.append((time.perf_counter() - start) * 1e6)
+        found.append(result is not None)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(0.99 * (len(latencies) - 1))], found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+    
+    rng = random.Random(0)
+    print(f"{'reglas':>7} {'camino':<18} {'compilar ms':>11} {'p50 µs':>8} {'p99 µs':>8}")
+    for n in args.sizes:
+        flags = synthetic_flags(n, rng)
+        messages = synthetic_messages(flags, args.messages, rng)
+        
+        start = time.perf_counter()
+        alternation = re.compile("|".join(re.escape(flag.lower()) for flag in sorted(flags, key=len, reverse=True)))
+        alternation_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        matcher = RedFlagMatcher(flags)
+        matcher_ms = (time.perf_counter() - start) * 1000
+        
+        paths = [
+            ("bucle `in`", 0.0, lambda message: loop_first(flags, message)),
+            ("alternación plana", alternation_ms, lambda message: alternation.search(message.lower())),
+            ("trie compilado", matcher_ms, matcher.first),
+        ]
+        baseline = None
+        for label, compile_ms, check in paths:
+            timed(check, messages[:100])  # Calentamiento
+            p50, p99, found = timed(check, messages)
+            baseline = baseline or (p50, found)
+            print(f"{n:>7} {label:<18} {compile_ms:>11.2f} {p50:>8.2f} {p99:>8.2f}   "
+                  f"x{baseline[0] / p50:.1f}, mismas detecciones: {found == baseline[1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+PediSafe BM25 Index
+Índice invertido BM25 en memoria sobre los mismos chunks del índice FAISS
+"""
+
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Minúsculas, sin acentos ("Convulsión" == "convulsion") y separado en palabras"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _TOKEN_RE.findall(text)
+
+
+class BM25Index:
+    """BM25 (Okapi) con los pesos por término precalculados
+    
+    La normalización por largo de documento no depende de la consulta, así que cada
+    posting guarda ya su peso final: buscar es sumar los postings de los términos
+    de la consulta. Los documentos se identifican con el id del docstore de FAISS.
+    """
+    
+    def __init__(self, doc_ids: List[str], postings: Dict[str, Tuple[np.ndarray, np.ndarray]]):
+        self.doc_ids = doc_ids
+        self.postings = postings
+    
+    @classmethod
+    def from_texts(cls, doc_ids: List[str], texts: List[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        term_counts = [Counter(tokenize(text)) for text in texts]
+        lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+        avg_length = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+        
+        raw = defaultdict(list)
+        for position, counts in enumerate(term_counts):
+            for term, tf in counts.items():
+                raw[term].append((position, tf))
+        
+        postings = {}
+        n = len(texts)
+        for term, entries in raw.items():
+            positions = np.array([position for position, _ in entries], dtype=np.int32)
+            tf = np.array([count for _, count in entries], dtype=np.float32)
+            idf = np.log(1 + (n - len(entries) + 0.5) / (len(entries) + 0.5))
+            norm = k1 * (1 - b + b * lengths[positions] / avg_length)
+            postings[term] = (positions, (idf * tf * (k1 + 1) / (tf + norm)).astype(np.float32))
+        return cls(doc_ids, postings)
+    
+    @classmethod
+    def from_vectorstore(cls, vectorstore: "FAISS", k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """Indexa los chunks del docstore de FAISS (mismo orden que los vectores)"""
+        doc_ids = [vectorstore.index_to_docstore_id[i] for i in sorted(vectorstore.index_to_docstore_id)]
+        texts = [vectorstore.docstore.search(doc_id).page_content for doc_id in doc_ids]
+        return cls.from_texts(doc_ids, texts, k1, b)
+    
+    def search(self, query: str, k: int = 20) -> List[Tuple[str, float]]:
+        """(id del docstore, score) de los k chunks con mayor BM25; solo los que comparten algún término"""
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self.doc_ids[i], float(scores[i])) for i in matched]
+    
+    def __len__(self) -> int:
+        return len(self.doc_ids)
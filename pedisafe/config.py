@@ -3,6 +3,10 @@ PediSafe Configuration
 Configuración central para el agente de triaje pediátrico
 """
 
+import json
+import os
+from pathlib import Path
+
 from i18n import get_text, get_triage_level_text
 
 def get_system_prompt(lang: str = "en") -> str:
@@ -14,24 +18,150 @@ def get_rag_template(lang: str = "en") -> str:
     return get_text("rag_template", lang)
 
 # Triage rules for deterministic pre-classification (Capa A)
-TRIAGE_RULES = {
-    "red_flags": [
-        "convulsión", "seizure", "convulsion",
-        "no respira", "dificultad para respirar", "breathing difficulty", "dificultad respiratoria",
-        "piel azul", "blue skin", "cianosis",
-        "cuello rígido", "rigidez de cuello", "stiff neck",
-        "inconsciente", "unresponsive", "no responde", "muy difícil de despertar",
-        "manchas púrpura", "purple spots", "petequias", "manchas de sangre",
-        "fontanela abultada", "bulging fontanelle"
+# Viven en un archivo aparte para que los clínicos las ajusten sin redeploy: triage.py lo
+# recompila y lo intercambia en caliente cuando cambia (revisa el archivo cada
+# TRIAGE_RULES_RELOAD_SECONDS). TRIAGE_RULES es la copia leída al arrancar.
+TRIAGE_RULES_FILE = Path(os.getenv("PEDISAFE_TRIAGE_RULES", Path(__file__).parent / "triage_rules.json"))
+TRIAGE_RULES_RELOAD_SECONDS = float(os.getenv("PEDISAFE_TRIAGE_RELOAD_SECONDS", "2"))
+TRIAGE_RULES = json.loads(TRIAGE_RULES_FILE.read_text(encoding="utf-8"))
+
+# Knowledge base indexing (Capa B)
+# Cualquier cambio aquí invalida la caché del índice FAISS en disco
+RAG_CONFIG = {
+    # RAG Best Practice: Hierarchical chunking con overlap adecuado
+    # chunk_size: 800-1200 tokens es óptimo para medical context
+    # overlap: 150-250 para preservar contexto entre chunks
+    "chunk_size": 1000,  # Tamaño óptimo para contexto médico
+    "chunk_overlap": 200,  # 20% overlap para coherencia
+    "separators": [
+        "\n## ",      # Secciones principales (H2)
+        "\n### ",     # Subsecciones (H3)
+        "\n#### ",    # Sub-subsecciones (H4)
+        "\n\n",       # Párrafos
+        "\n",         # Líneas
+        ". ",         # Oraciones
+        " "           # Palabras (último recurso)
     ],
-    "age_thresholds": {
-        "0-3_months": {"temp_c": 38.0, "level": "ROJO"},
-        "3-6_months": {"temp_c": 38.3, "level": "NARANJA"},
-        "6-12_months": {"temp_c": 38.9, "level": "AMARILLO"},
-        "over_12_months": {"temp_c": 39.0, "level": "AMARILLO"}
-    }
+    # "hierarchical" (small-to-big): se vectorizan fragmentos de child_size caracteres y al
+    # LLM llega su sección H2 completa (partida si supera parent_max), sin duplicados.
+    # "recursive": chunks de chunk_size con chunk_overlap (comportamiento anterior)
+    "chunking": {
+        "mode": os.getenv("PEDISAFE_CHUNKING", "hierarchical"),
+        "child_size": 400,
+        "parent_max": 2000,
+    },
+    # Directorio de la caché del índice (None = pedisafe/faiss_index)
+    "index_cache_dir": os.getenv("PEDISAFE_INDEX_DIR"),
+    # Caché sqlite de vectores por (modelo, hash del texto) compartida por ambos backends
+    "embedding_cache": True,
+    # Índices compartidos en memoria a la vez (LRU). Con embeddings de OpenAI cada API key
+    # tiene su propio índice (docstore, BM25, matrices MMR); los motores admiten el doble
+    # (uno por idioma). Al superarlo se libera el menos usado y se recarga desde disco
+    "shared_registry_size": int(os.getenv("PEDISAFE_SHARED_INDEXES", "4")),
+    # Consultas recientes cuyo embedding se guarda en memoria (LRU); 0 = desactivado
+    "query_cache_size": 1024,
+    # Servir el índice con mmap de solo lectura: un solo juego de páginas por nodo
+    "mmap_index": os.getenv("PEDISAFE_MMAP_INDEX", "1") != "0",
+    # Tipo de índice: "flat" (exacto), "ivf", "hnsw", "pq" o "ivfpq" (aproximados)
+    # Ver benchmarks/bench_ann_index.py para elegir según el tamaño del corpus
+    "index_type": os.getenv("PEDISAFE_INDEX_TYPE", "flat"),
+    "index_params": {
+        "nlist": 0,             # Listas IVF (0 = ~4*sqrt(n))
+        "nprobe": 8,            # Listas IVF visitadas por consulta
+        "hnsw_m": 32,           # Vecinos por nodo HNSW
+        "ef_construction": 80,
+        "ef_search": 64,        # Candidatos HNSW por consulta
+        "pq_m": 0,              # Subcuantizadores PQ (0 = dim/8)
+    },
+    # Almacenamiento de vectores: "float32", "float16" (1/2 de memoria) o "int8" (1/4)
+    # Con pérdida (float16/int8/PQ) los k*rescore_factor candidatos se re-puntúan con los
+    # vectores float32 del snapshot (mmap: solo se leen las filas candidatas); 1 = sin re-scoring
+    "vector_storage": os.getenv("PEDISAFE_VECTOR_STORAGE", "float32"),
+    "rescore_factor": 4,
+    # Precargar modelo de embeddings + índice en un hilo mientras la UI se renderiza
+    "background_warmup": os.getenv("PEDISAFE_WARMUP", "1") != "0",
+    # Vectorización en la ingesta: "serial" (ruta por defecto de LangChain), "batched"
+    # (lotes explícitos) o "parallel" (pool multi-proceso para sentence-transformers,
+    # requests concurrentes por lote para OpenAI). workers=0 -> número de CPUs
+    "ingestion": {
+        "mode": os.getenv("PEDISAFE_INGESTION_MODE", "batched"),
+        "batch_size": int(os.getenv("PEDISAFE_EMBED_BATCH_SIZE", "64")),
+        "workers": int(os.getenv("PEDISAFE_EMBED_WORKERS", "0")),
+    },
+    # MMR con NumPy sobre la matriz de vectores normalizados del snapshot (en vez del bucle
+    # genérico de langchain), servida con mmap (float16 si vector_storage no es float32).
+    # La matriz chunk-chunk n x n solo se precalcula si hay <= mmr_gram_limit chunks: ocupa
+    # 4*n^2 bytes (64 MB con 4096 chunks, ~10x un índice plano de 384 dims) y solo ahorra
+    # ~0.04 ms por consulta frente a calcular el bloque fetch_k x fetch_k de los candidatos
+    # (benchmarks/bench_mmr.py). 0 = nunca; subirlo solo con corpus pequeños y RAM de sobra
+    "vectorized_mmr": os.getenv("PEDISAFE_VECTORIZED_MMR", "1") != "0",
+    "mmr_gram_limit": int(os.getenv("PEDISAFE_MMR_GRAM_LIMIT", "0")),
+    # Filtro por banda etaria (TRIAGE_RULES["age_thresholds"]) con la edad extraída del mensaje:
+    # solo chunks generales o de esa banda llegan al MMR (fetch_k candidatos de la misma banda)
+    "age_filter": {
+        "enabled": os.getenv("PEDISAFE_AGE_FILTER", "1") != "0",
+        "fetch_k": 12,
+    },
+    # Recuperación híbrida: MMR denso + BM25 (índice invertido construido junto al snapshot)
+    # fusionados con reciprocal rank fusion; sparse_k = candidatos léxicos por consulta
+    "hybrid_search": {
+        "enabled": os.getenv("PEDISAFE_HYBRID_SEARCH", "1") != "0",
+        "sparse_k": 20,
+        "rrf_k": 60,
+        "bm25_k1": 1.5,
+        "bm25_b": 0.75,
+    },
+    # Señal ROJO de la Capa A (textual o regla de fiebre con level ROJO): respuesta ROJO
+    # localizada precalculada (sin retrieval ni LLM);
+    # elaborate = la app muestra además la respuesta completa del LLM: la tarjeta ROJO ya está
+    # en pantalla, pero la sesión queda bloqueada (spinner) hasta que el LLM termina
+    "emergency_fast_path": {
+        "enabled": os.getenv("PEDISAFE_EMERGENCY_FAST_PATH", "1") != "0",
+        "elaborate": os.getenv("PEDISAFE_EMERGENCY_ELABORATE", "0") != "0",
+    },
+    # Re-ranking opcional con un cross-encoder en CPU (requiere sentence-transformers):
+    # puntúa los `candidates` chunks recuperados en un lote y se queda con los `k` mejores.
+    # Si el lote no termina en budget_ms se usa el top 6 de los candidatos en orden MMR/RRF
+    # (puede diferir del resultado sin reranker: el RRF se hace sobre `candidates` chunks densos);
+    # el lote vencido se cancela y mientras siga corriendo las consultas no esperan al reranker
+    "reranker": {
+        "enabled": os.getenv("PEDISAFE_RERANKER", "0") != "0",
+        "model": os.getenv("PEDISAFE_RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+        "candidates": 20,
+        "k": 4,
+        "budget_ms": float(os.getenv("PEDISAFE_RERANKER_BUDGET_MS", "150")),
+    },
+    # Contextos ya ensamblados (por tupla de ids de chunks) que se reutilizan sin reformatear
+    "context_cache_size": 256,
+    # Caché semántica de respuestas del LLM: misma clave exacta (idioma, proveedor, Capa A,
+    # edad/temperatura, historial) y similitud coseno de la consulta >= similarity
+    "response_cache": {
+        "enabled": os.getenv("PEDISAFE_RESPONSE_CACHE", "1") != "0",
+        "similarity": 0.95,
+        "ttl_seconds": 3600,
+        "max_entries": 512,
+    },
+}
+
+# Modelo de embeddings por proveedor (forma parte de la clave de caché)
+EMBEDDING_MODELS = {
+    "cerebras": "sentence-transformers/all-MiniLM-L6-v2",  # Local, gratis
+    "openai": "text-embedding-3-small",  # Más barato: $0.02/1M tokens
+}
+
+# Map de archivos a URLs específicas - SOLO fuentes oficiales AAP/NHS
+# NO incluir documentos internos consolidados o ejemplos
+SOURCE_URLS = {
+    "aap_fever_baby.md": ("Fever and Your Baby - AAP", "https://www.healthychildren.org/English/health-issues/conditions/fever/Pages/Fever-and-Your-Baby.aspx"),
+    "aap_fever_without_fear.md": ("Fever Without Fear - AAP", "https://www.healthychildren.org/English/health-issues/conditions/fever/Pages/Fever-Without-Fear.aspx"),
+    "aap_symptom_checker.md": ("Symptom Checker: Fever - AAP", "https://www.healthychildren.org/English/tips-tools/symptom-checker/Pages/symptomviewer.aspx?symptom=Fever+(0-12+Months)"),
+    "aap_when_to_call.md": ("When to Call the Pediatrician - AAP", "https://www.healthychildren.org/English/health-issues/conditions/fever/Pages/When-to-Call-the-Pediatrician.aspx"),
+    "nhs_fever_children.md": ("High Temperature in Children - NHS", "https://www.nhs.uk/conditions/fever-in-children/"),
 }
 
+# Fuentes citadas en la respuesta de emergencia precalculada
+EMERGENCY_SOURCES = ("aap_when_to_call.md", "aap_fever_baby.md", "nhs_fever_children.md")
+
 def get_ui_config(lang: str = "en") -> dict:
     """Get UI configuration in specified language"""
     return {
@@ -0,0 +1,205 @@
+"""
+PediSafe Embedding Cache
+Caché persistente (sqlite) de vectores por (modelo, hash del texto) delante de cualquier backend,
+y caché LRU en memoria para los embeddings de consultas
+"""
+
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Máximo de parámetros por consulta IN (...) en sqlite
+_SQLITE_BATCH = 500
+
+
+class CachedEmbeddings(Embeddings):
+    """Envuelve HuggingFaceEmbeddings u OpenAIEmbeddings y reutiliza vectores ya calculados
+    
+    Solo se cachean los documentos (chunks): un texto idéntico nunca se vuelve a
+    vectorizar al reconstruir, cambiar el chunking o re-indexar. Los vectores se
+    guardan como float32 en una tabla sqlite compartida por todos los procesos.
+    """
+    
+    def __init__(self, embeddings: Embeddings, model_name: str, cache_path: str):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache_path = Path(cache_path)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+    
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.cache_path), check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")  # Lectores y escritores concurrentes
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, text_hash BLOB NOT NULL, vector BLOB NOT NULL,"
+                " PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+            )
+            self._conn = conn
+        return self._conn
+    
+    @staticmethod
+    def _text_hash(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+    
+    def _lookup(self, hashes: List[bytes]) -> Dict[bytes, List[float]]:
+        """Busca vectores cacheados para una lista de hashes"""
+        found = {}
+        conn = self._connection()
+        for start in range(0, len(hashes), _SQLITE_BATCH):
+            batch = hashes[start:start + _SQLITE_BATCH]
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN "
+                f"({','.join('?' * len(batch))})",
+                [self.model_name, *batch]
+            )
+            for text_hash, vector in rows:
+                found[text_hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+    
+    def _store(self, items: Dict[bytes, List[float]]):
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(self.model_name, text_hash, np.asarray(vector, dtype=np.float32).tobytes())
+                 for text_hash, vector in items.items()]
+            )
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Vectoriza solo los textos que no están en caché"""
+        hashes = [self._text_hash(text) for text in texts]
+        try:
+            with self._lock:
+                cached = self._lookup(list(set(hashes)))
+        except sqlite3.Error as e:
+            # Caché no disponible: degradar a vectorizar todo
+            print(f"⚠️ Caché de embeddings no disponible: {e}")
+            return self.embeddings.embed_documents(texts)
+        
+        # Textos repetidos dentro del mismo lote se vectorizan una sola vez
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached:
+                missing.setdefault(text_hash, text)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            try:
+                with self._lock:
+                    self._store(computed)
+            except sqlite3.Error as e:
+                print(f"⚠️ No se pudo guardar en la caché de embeddings: {e}")
+            cached.update(computed)
+        
+        return [list(cached[text_hash]) for text_hash in hashes]
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+    
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Lote de consultas: como embed_query, no pasa por la tabla (solo se persisten chunks)"""
+        return embed_queries(self.embeddings, texts)
+
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Varias consultas en un lote, sin guardarlas en la caché persistente si la hay"""
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    return embeddings.embed_documents(texts)
+
+
+def normalize_query(text: str) -> str:
+    """Minúsculas y espacios colapsados ("Mi bebé  tiene 38.2" -> "mi bebé tiene 38.2")"""
+    return " ".join(text.lower().split())
+
+
+class LRUQueryEmbeddings(Embeddings):
+    """Caché LRU acotada de embed_query por (modelo, consulta normalizada)
+    
+    Muchos padres mandan mensajes casi idénticos ("my 2 month old has 38.2"): un acierto
+    evita la llamada de red a OpenAI o la pasada de MiniLM. Se vectoriza la consulta
+    normalizada, así un acierto devuelve exactamente lo mismo que un fallo.
+    """
+    
+    def __init__(self, embeddings: Embeddings, model_name: str, max_size: int = 1024):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[tuple, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def embed_query(self, text: str) -> List[float]:
+        normalized = normalize_query(text)
+        key = (self.model_name, normalized)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return list(vector)
+            self.misses += 1
+        
+        # Fuera del lock: no bloquear otras sesiones durante la llamada al backend
+        vector = self.embeddings.embed_query(normalized)
+        with self._lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return list(vector)
+    
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """embed_query de muchas consultas: los fallos se vectorizan en un solo lote"""
+        keys = [(self.model_name, normalize_query(text)) for text in texts]
+        found, missing = {}, {}
+        with self._lock:
+            for key in keys:
+                vector = self._cache.get(key)
+                if vector is not None:
+                    self._cache.move_to_end(key)
+                    found[key] = vector
+                    self.hits += 1
+                elif key not in missing:
+                    missing[key] = key[1]
+                    self.misses += 1
+                else:
+                    self.hits += 1  # Repetida dentro del lote
+        
+        if missing:
+            computed = dict(zip(missing, embed_queries(self.embeddings, list(missing.values()))))
+            with self._lock:
+                for key, vector in computed.items():
+                    self._cache[key] = vector
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+            found.update(computed)
+        return [list(found[key]) for key in keys]
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._cache),
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
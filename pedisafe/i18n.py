@@ -89,6 +89,29 @@ TRANSLATIONS = {
         "invalid_key_error": "❌ Invalid API Key. Please verify it's correct.",
         "generic_error": "❌ Error: {error}",
         
+        # Emergency fast path (Layer A red flag: no retrieval or LLM call)
+        "emergency_response": """🔴 **RED - {description}**
+
+**Warning sign detected:** {flag}
+
+**What to do now**
+- {action}.
+- Do not wait to see whether the fever goes down or the symptom improves.
+- If your child stops breathing, turns blue or cannot be woken, call 911 immediately.
+- Do not give medication before your child is evaluated unless a professional tells you to.
+
+**Warning signs to watch for on the way**
+- Breathing difficulty, bluish lips or skin
+- Seizure, stiff neck, bulging soft spot
+- Purple spots that do not fade when pressed
+- Very hard to wake up or not responding
+
+PediSafe does not replace a medical professional: this is an emergency and your child needs to be seen now.
+
+**Medical Sources**
+{sources}""",
+        "emergency_elaboration": "📋 **More detail (generated from the guidelines):**",
+        
         # System prompts
         "system_prompt": """You are PediSafe, an INFORMATIONAL pediatric fever triage assistant.
 Your goal: help caregivers decide the "next step" (home care / call pediatrician / emergency),
@@ -246,6 +269,29 @@ RESPONSE FORMAT (MANDATORY):
         "invalid_key_error": "❌ API Key inválida. Verifica que esté correcta.",
         "generic_error": "❌ Error: {error}",
         
+        # Ruta rápida de emergencia (red flag de la Capa A: sin retrieval ni LLM)
+        "emergency_response": """🔴 **ROJO - {description}**
+
+**Señal de alarma detectada:** {flag}
+
+**Qué hacer ahora**
+- {action}.
+- No esperes a ver si baja la fiebre o mejora el síntoma.
+- Si tu hijo/a deja de respirar, se pone azul o no despierta, llama al 911 de inmediato.
+- No le des medicamentos antes de que lo evalúen, salvo indicación de un profesional.
+
+**Señales de alarma a vigilar en el camino**
+- Dificultad para respirar, labios o piel azulados
+- Convulsión, rigidez de cuello, fontanela abultada
+- Manchas púrpura que no desaparecen al presionar
+- Muy difícil de despertar o no responde
+
+PediSafe no sustituye a un profesional médico: es una urgencia y tu hijo/a necesita ser evaluado ahora.
+
+**Fuentes Médicas**
+{sources}""",
+        "emergency_elaboration": "📋 **Más detalle (generado a partir de las guías):**",
+        
         # System prompts
         "system_prompt": """Eres PediSafe, un asistente INFORMATIVO de triaje pediátrico para fiebre.
 Tu objetivo: ayudar a un cuidador a decidir el "siguiente paso" (casa / llamar al pediatra / urgencias),
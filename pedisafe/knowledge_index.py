@@ -0,0 +1,721 @@
+"""
+PediSafe Knowledge Index
+Capa de recuperación compartida: embeddings + índice FAISS de la base de conocimiento
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from config import RAG_CONFIG, EMBEDDING_MODELS, SOURCE_URLS
+
+# Imports pesados (langchain_community, FAISS, openai, torch/sentence-transformers) diferidos
+# hasta que el backend que los necesita se usa: importar este módulo es casi gratis
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+    from langchain_core.embeddings import Embeddings
+
+# Incrementar si cambia el formato del índice guardado en disco
+INDEX_CACHE_VERSION = 8
+MANIFEST_FILE = "manifest.json"
+PARENTS_FILE = "parents.json"
+EMBEDDING_CACHE_FILE = "embeddings.sqlite"
+DEFAULT_INDEX_CACHE_DIR = Path(__file__).parent / "faiss_index"
+
+
+class SharedRegistry:
+    """Registro de objetos costosos compartidos por todo el proceso (thread-safe)
+    
+    Con `max_items` es un LRU: al superar el límite se suelta el objeto usado hace más
+    tiempo (las sesiones que aún lo tienen siguen usándolo; el próximo pedido lo vuelve
+    a construir). Evita que cada API key distinta deje un índice completo en memoria.
+    """
+    
+    def __init__(self, max_items: Optional[int] = None):
+        self.max_items = max_items
+        self._items: "OrderedDict[tuple, object]" = OrderedDict()
+        self._build_locks: Dict[tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+    
+    def get_or_create(self, key: tuple, factory: Callable[[], object]):
+        """Devuelve el objeto de `key`, construyéndolo una sola vez con `factory`"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+                return item
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        
+        # Un lock por clave: una construcción no bloquea al resto de sesiones
+        with build_lock:
+            try:
+                item = self._items.get(key)
+                if item is None:
+                    item = factory()
+                    with self._lock:
+                        self._items[key] = item
+                        self._evict()
+            finally:
+                # Construido o fallido, el lock ya no hace falta (si factory falla no queda colgado)
+                with self._lock:
+                    if self._build_locks.get(key) is build_lock:
+                        del self._build_locks[key]
+        return item
+    
+    def _evict(self):
+        while self.max_items is not None and len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._build_locks.clear()
+    
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._items
+    
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class IndexState(NamedTuple):
+    """Una versión publicada del índice: todo lo que sirve una consulta, construido junto"""
+    vectorstore: "FAISS"
+    retriever: Any
+    sparse_index: Optional[Any] = None
+    snapshot: Optional[str] = None
+    parents: Dict[str, str] = {}  # parent_id -> texto de la sección, una vez por sección
+    version: str = ""  # Cambia con cada refresh que modifica el índice (clave de cachés derivadas)
+
+
+class KnowledgeIndex:
+    """Embeddings + índice FAISS + retriever, independientes del LLM y del idioma
+    
+    refresh() construye la versión nueva aparte y la publica con una sola asignación de
+    `_state`: una consulta en curso nunca combina el vectorstore de una versión con el
+    retriever o el BM25 de otra.
+    """
+    
+    def __init__(self, knowledge_dir: str = "knowledge", provider: str = "openai", api_key: str = "",
+                 index_cache_dir: Optional[str] = None):
+        self.api_key = api_key
+        self.knowledge_dir = Path(knowledge_dir)
+        self.index_cache_dir = Path(index_cache_dir or RAG_CONFIG["index_cache_dir"] or DEFAULT_INDEX_CACHE_DIR)
+        self.provider = provider
+        self._state: Optional[IndexState] = None
+        self._refresh_lock = threading.Lock()
+        
+        self._setup_embeddings()
+        self._load_knowledge_base()
+    
+    @property
+    def vectorstore(self) -> Optional["FAISS"]:
+        return self._state.vectorstore if self._state else None
+    
+    @property
+    def retriever(self):
+        return self._state.retriever if self._state else None
+    
+    @property
+    def sparse_index(self):
+        return self._state.sparse_index if self._state else None
+    
+    @property
+    def parents(self) -> Dict[str, str]:
+        return self._state.parents if self._state else {}
+    
+    @property
+    def version(self) -> str:
+        return self._state.version if self._state else ""
+    
+    def _setup_embeddings(self):
+        """Configura embeddings según el proveedor, con caché persistente de vectores"""
+        self.embedding_model = embedding_model_for(self.provider)
+        from batch_embeddings import BatchedEmbeddings
+        from embedding_cache import CachedEmbeddings, LRUQueryEmbeddings
+        
+        embeddings = self._create_embedder()
+        ingestion = RAG_CONFIG["ingestion"]
+        if ingestion["mode"] != "serial":
+            # Lotes explícitos (y pool multi-proceso / requests concurrentes en modo parallel)
+            embeddings = BatchedEmbeddings(
+                embeddings, ingestion["mode"], ingestion["batch_size"], ingestion["workers"]
+            )
+        self.embedding_cache = self.query_cache = None
+        if RAG_CONFIG["embedding_cache"]:
+            # Texto ya vectorizado = 0 llamadas a OpenAI / 0 pasadas de MiniLM
+            embeddings = self.embedding_cache = CachedEmbeddings(
+                embeddings, self.embedding_model, str(self.index_cache_dir / EMBEDDING_CACHE_FILE)
+            )
+        if RAG_CONFIG["query_cache_size"] > 0:
+            # Consultas repetidas en get_response no vuelven a vectorizarse
+            embeddings = self.query_cache = LRUQueryEmbeddings(
+                embeddings, self.embedding_model, RAG_CONFIG["query_cache_size"]
+            )
+        self.embeddings = embeddings
+    
+    def _create_embedder(self) -> "Embeddings":
+        """Crea el backend de embeddings del proveedor"""
+        if self.provider == "cerebras":
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+            
+            # Cerebras no tiene embeddings propios
+            # Usar Hugging Face embeddings (100% GRATIS, sin API key necesaria)
+            print("🆓 Usando embeddings gratuitos de Hugging Face (sentence-transformers)")
+            return HuggingFaceEmbeddings(
+                model_name=self.embedding_model,
+                model_kwargs={'device': 'cpu'},
+                encode_kwargs={'normalize_embeddings': True}
+            )
+        from langchain_openai import OpenAIEmbeddings
+        
+        return OpenAIEmbeddings(
+            api_key=self.api_key,
+            model=self.embedding_model
+        )
+    
+    def _settings_key(self) -> str:
+        """Hash del modelo de embeddings + chunking: vectores de distinta configuración no se mezclan"""
+        digest = hashlib.sha256()
+        digest.update(f"v{INDEX_CACHE_VERSION}|{self.embedding_model}".encode("utf-8"))
+        digest.update(json.dumps(
+            [RAG_CONFIG["chunk_size"], RAG_CONFIG["chunk_overlap"], RAG_CONFIG["separators"], RAG_CONFIG["chunking"]]
+        ).encode("utf-8"))
+        return digest.hexdigest()[:16]
+    
+    def _hash_files(self) -> Dict[str, str]:
+        """sha256 del contenido de cada archivo, por ruta relativa"""
+        return {
+            file.relative_to(self.knowledge_dir).as_posix(): hashlib.sha256(file.read_bytes()).hexdigest()
+            for file in sorted(self.knowledge_dir.glob("**/*.md"))
+        }
+    
+    def _load_knowledge_base(self):
+        """Carga y vectoriza los documentos de conocimiento y publica la versión nueva"""
+        # Un refresh a la vez; las consultas no esperan: siguen con el estado anterior
+        with self._refresh_lock:
+            self._state = self._build_state()
+    
+    def _build_state(self) -> IndexState:
+        """Vectorstore + retriever (+ BM25) de la versión actual de knowledge/, sin publicarlos"""
+        self.index_dir = self.index_cache_dir / self._settings_key()
+        flat, snapshot, parents = self._sync_index()
+        vectorstore = self._with_serving_index(flat, snapshot)
+        
+        # RAG Best Practice: Hybrid search con MMR para diversidad
+        # MMR (Maximal Marginal Relevance) reduce redundancia en resultados
+        reranker = RAG_CONFIG["reranker"]
+        k = reranker["candidates"] if reranker["enabled"] else 6
+        search_kwargs = {
+            "k": k,              # Top 6 chunks (mejor cobertura); con reranker, todos los candidatos
+            "fetch_k": 20,       # Fetch 20, luego MMR selecciona 6
+            "lambda_mult": 0.7   # Balance relevancia (1.0) vs diversidad (0.0)
+        }
+        if RAG_CONFIG["vectorized_mmr"]:
+            from retrievers import VectorizedMMRRetriever
+            
+            vectors, gram = self._load_mmr_matrices(flat, snapshot)
+            retriever = VectorizedMMRRetriever(
+                vectorstore=vectorstore, vectors=vectors, gram=gram, age_masks=self._age_masks(flat),
+                age_fetch_k=RAG_CONFIG["age_filter"]["fetch_k"],
+                # Con reranker el filtro completa solo hasta lo que se entrega, no hasta los candidatos
+                pad_k=max(reranker["k"], 6) if reranker["enabled"] else None, **search_kwargs
+            )
+        else:
+            retriever = vectorstore.as_retriever(
+                search_type="mmr",  # MMR en lugar de similarity para mayor diversidad
+                search_kwargs=search_kwargs
+            )
+        
+        sparse_index = None
+        hybrid = RAG_CONFIG["hybrid_search"]
+        if hybrid["enabled"]:
+            from retrievers import HybridRetriever
+            
+            # Términos clínicos exactos que los embeddings pueden no acercar
+            sparse_index = self._load_sparse_index(vectorstore, snapshot)
+            retriever = HybridRetriever(
+                dense=retriever, sparse=sparse_index, vectorstore=vectorstore,
+                k=k, sparse_k=hybrid["sparse_k"], rrf_k=hybrid["rrf_k"]
+            )
+        
+        if reranker["enabled"]:
+            from retrievers import RerankingRetriever
+            
+            # Cross-encoder sobre los candidatos; si no llega a tiempo, top 6 en orden MMR/RRF
+            retriever = RerankingRetriever(
+                base=retriever, reranker=get_shared_reranker(reranker["model"], reranker["budget_ms"]),
+                k=reranker["k"], fallback_k=6
+            )
+        # Sin snapshot guardado no hay hash de contenido: cada índice en memoria es una versión nueva
+        version = f"{self.index_dir.name}/{snapshot or 'mem-' + os.urandom(8).hex()}"
+        return IndexState(vectorstore, retriever, sparse_index, snapshot, parents, version)
+    
+    def retrieve(self, query: str, age_months: Optional[float] = None) -> List["Document"]:
+        """Chunks para la consulta; con la edad del mensaje prioriza los de su banda etaria"""
+        from age_bands import age_band_for
+        
+        age_band = age_band_for(age_months) if RAG_CONFIG["age_filter"]["enabled"] else None
+        if age_band is None or not RAG_CONFIG["vectorized_mmr"]:
+            # El retriever MMR de langchain no admite el filtro por banda
+            return self.retriever.invoke(query)
+        return self.retriever.invoke(query, age_band=age_band)
+    
+    def retrieve_batch(self, queries: List[str],
+                       ages_months: Optional[List[Optional[float]]] = None) -> List[List["Document"]]:
+        """retrieve() para muchas consultas: un lote de embeddings y una búsqueda FAISS matricial"""
+        import numpy as np
+        from age_bands import age_band_for
+        from embedding_cache import embed_queries, normalize_query
+        
+        ages_months = ages_months or [None] * len(queries)
+        if not RAG_CONFIG["vectorized_mmr"]:
+            return [self.retrieve(query, age) for query, age in zip(queries, ages_months)]
+        if not queries:
+            return []
+        
+        # Mismo texto normalizado que vectoriza la caché LRU de consultas; las consultas
+        # (mensajes de padres) no se guardan en la caché persistente de chunks
+        vectors = np.asarray(embed_queries(self.embeddings, [normalize_query(q) for q in queries]),
+                             dtype=np.float32)
+        age_bands = [age_band_for(age) if RAG_CONFIG["age_filter"]["enabled"] else None for age in ages_months]
+        return self.retriever.batch_select(queries, vectors, age_bands)
+    
+    def refresh(self):
+        """Re-indexa solo los archivos modificados y publica el nuevo índice"""
+        # El índice en uso no se modifica: las consultas en curso siguen con el anterior
+        self._load_knowledge_base()
+    
+    def _sync_index(self) -> Tuple["FAISS", Optional[str], Dict[str, str]]:
+        """Sincroniza el índice en disco con knowledge/ usando el manifest por archivo
+        
+        Devuelve el vectorstore plano (fuente de verdad), el snapshot donde quedó guardado
+        y el texto de las secciones padre por parent_id.
+        """
+        from langchain_community.vectorstores import FAISS
+        
+        file_hashes = self._hash_files()
+        manifest = self._read_manifest()
+        indexed = manifest.get("files", {})
+        changed = [path for path, file_hash in file_hashes.items()
+                   if indexed.get(path, {}).get("sha256") != file_hash]
+        removed = [path for path in indexed if path not in file_hashes]
+        
+        if not changed and not removed:
+            # Snapshot publicado sin cambios: mmap de solo lectura compartido entre workers
+            vectorstore = self._load_snapshot(manifest.get("snapshot"), mmap=RAG_CONFIG["mmap_index"])
+            parents = self._load_parents(manifest.get("snapshot"))
+            if vectorstore is not None and parents is not None:
+                print(f"⚡ Índice FAISS cargado desde caché ({len(indexed)} archivos sin cambios)")
+                return vectorstore, manifest["snapshot"], parents
+        
+        # Hay cambios: cargar una copia en memoria modificable del último snapshot
+        vectorstore = self._load_snapshot(manifest.get("snapshot"), mmap=False) if indexed else None
+        parents = self._load_parents(manifest.get("snapshot")) if vectorstore is not None else None
+        if vectorstore is None or parents is None:
+            vectorstore, parents, indexed = None, {}, {}
+            changed, removed = list(file_hashes), []
+        
+        print(f"♻️ Re-indexando {len(changed)} archivos ({len(removed)} eliminados, "
+              f"{len(file_hashes) - len(changed)} sin cambios)")
+        
+        # Quitar los vectores obsoletos del índice FAISS y del docstore
+        stale_ids = [chunk_id for path in changed + removed
+                     for chunk_id in indexed.get(path, {}).get("chunk_ids", [])]
+        if vectorstore is not None and stale_ids:
+            vectorstore.delete(stale_ids)
+        # parent_id es "<ruta relativa>#<n>": las secciones de esos archivos también caducan
+        stale_paths = set(changed + removed)
+        parents = {parent_id: text for parent_id, text in parents.items()
+                   if parent_id.rpartition("#")[0] not in stale_paths}
+        
+        # Dividir y vectorizar solo los archivos nuevos o modificados
+        files = {path: {"sha256": file_hash, "chunk_ids": indexed.get(path, {}).get("chunk_ids", [])}
+                 for path, file_hash in file_hashes.items()}
+        splits, ids = [], []
+        for path in changed:
+            chunks, file_parents = self._split_file(self.knowledge_dir / path)
+            parents.update(file_parents)
+            # Ruta + contenido: dos archivos idénticos no comparten ids en el docstore
+            prefix = hashlib.sha256(f"{path}\0{file_hashes[path]}".encode("utf-8")).hexdigest()[:16]
+            chunk_ids = [f"{prefix}:{i}" for i in range(len(chunks))]
+            files[path]["chunk_ids"] = chunk_ids
+            splits.extend(chunks)
+            ids.extend(chunk_ids)
+        
+        if vectorstore is None:
+            # RAG Best Practice: FAISS con IndexFlatL2 para búsqueda exacta
+            vectorstore = FAISS.from_documents(splits, self.embeddings, ids=ids)
+        elif splits:
+            vectorstore.add_documents(splits, ids=ids)
+        
+        snapshot = self._save_snapshot(vectorstore, files, parents)
+        if snapshot and RAG_CONFIG["mmap_index"]:
+            # Servir desde el snapshot recién escrito para compartir páginas con otros workers
+            vectorstore = self._load_snapshot(snapshot, mmap=True) or vectorstore
+        return vectorstore, snapshot, parents
+    
+    def _with_serving_index(self, vectorstore: "FAISS", snapshot: Optional[str]) -> "FAISS":
+        """Sustituye el índice plano float32 por el configurado (IVF, HNSW, PQ / float16, int8)
+        
+        El índice se entrena con los vectores del plano (sin re-embeddings) y se guarda
+        junto al snapshot, así que solo se entrena una vez por contenido. Si almacena
+        vectores con pérdida, los candidatos se re-puntúan contra el plano exacto.
+        """
+        index_type = RAG_CONFIG["index_type"]
+        storage = RAG_CONFIG["vector_storage"]
+        if index_type == "flat" and storage == "float32":
+            return vectorstore
+        
+        from langchain_community.vectorstores import FAISS
+        from ann_index import (build_ann_index, configure_search, index_vectors, is_lossy,
+                               read_index, with_rescoring, write_index)
+        
+        params = RAG_CONFIG["index_params"]
+        params_key = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+        name = f"index.{index_type}-{storage}-{params_key}.faiss"
+        path = self.index_dir / snapshot / name if snapshot else None
+        
+        index = None
+        if path is not None and path.exists():
+            try:
+                index = read_index(path, mmap=RAG_CONFIG["mmap_index"])
+            except Exception as e:
+                print(f"⚠️ Índice {index_type}/{storage} inválido, re-entrenando: {e}")
+        if index is None:
+            index = build_ann_index(index_vectors(vectorstore.index), index_type, params, storage)
+            if index is None:
+                print(f"ℹ️ Corpus muy pequeño para entrenar '{index_type}' "
+                      f"({vectorstore.index.ntotal} vectores): se usa búsqueda exacta")
+                return vectorstore
+            print(f"🧭 Índice '{index_type}' ({storage}) entrenado con {index.ntotal} vectores")
+            if path is not None:
+                try:
+                    write_index(index, path)
+                    if RAG_CONFIG["mmap_index"]:
+                        index = read_index(path, mmap=True)
+                except OSError as e:
+                    print(f"⚠️ No se pudo guardar el índice {index_type}: {e}")
+        
+        configure_search(index, params)
+        if is_lossy(index_type, storage):
+            # Top-k del MMR igual al de float32: re-puntuar k*factor candidatos con vectores exactos
+            index = with_rescoring(index, vectorstore.index, RAG_CONFIG["rescore_factor"])
+        return FAISS(self.embeddings, index, vectorstore.docstore, vectorstore.index_to_docstore_id)
+    
+    def _age_masks(self, vectorstore: "FAISS"):
+        """Bits de bandas etarias de cada chunk, en el orden de los vectores"""
+        import numpy as np
+        from age_bands import band_mask
+        
+        mapping = vectorstore.index_to_docstore_id
+        return np.array([
+            band_mask(vectorstore.docstore.search(mapping[i]).metadata.get("age_bands", []))
+            for i in range(len(mapping))
+        ], dtype=np.uint8)
+    
+    def _load_mmr_matrices(self, vectorstore: "FAISS", snapshot: Optional[str]):
+        """Vectores normalizados y similitudes chunk-chunk del snapshot, para el MMR vectorizado
+        
+        Se calculan una vez por snapshot y se guardan como .npy junto a él; se sirven siempre
+        con mmap de solo lectura (solo se leen las filas candidatas), así no duplican en RAM el
+        índice. Con vector_storage comprimido se guardan en float16, no en float32.
+        """
+        import numpy as np
+        from ann_index import index_vectors
+        
+        dtype = np.float32 if RAG_CONFIG["vector_storage"] == "float32" else np.float16
+        limit = RAG_CONFIG["mmr_gram_limit"]
+        names = (f"mmr_vectors-{np.dtype(dtype).name}.npy", "mmr_gram.npy")
+        paths = [self.index_dir / snapshot / name for name in names] if snapshot else []
+        if paths and paths[0].exists():
+            try:
+                vectors = np.load(paths[0], mmap_mode="r")
+                use_gram = len(vectors) <= limit and paths[1].exists()
+                return vectors, np.load(paths[1], mmap_mode="r") if use_gram else None
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Matrices MMR inválidas, recalculando: {e}")
+        
+        vectors = index_vectors(vectorstore.index).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms > 0, norms, 1)
+        # n x n crece cuadrático: sobre el límite se calcula solo el bloque de candidatos por consulta
+        gram = vectors @ vectors.T if len(vectors) <= limit else None
+        vectors = vectors.astype(dtype, copy=False)
+        
+        matrices = [vectors, gram]
+        for i, (path, matrix) in enumerate(zip(paths, matrices)):
+            if matrix is None:
+                continue
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".npy")
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, matrix)
+                os.replace(tmp_path, path)
+                matrices[i] = np.load(path, mmap_mode="r")  # Libera la copia en memoria
+            except (OSError, ValueError) as e:
+                print(f"⚠️ No se pudo guardar {path.name}: {e}")
+        return tuple(matrices)
+    
+    def _load_sparse_index(self, vectorstore: "FAISS", snapshot: Optional[str]):
+        """Índice BM25 de los chunks del snapshot, construido una vez y guardado junto a él"""
+        from bm25_index import BM25Index
+        
+        hybrid = RAG_CONFIG["hybrid_search"]
+        path = self.index_dir / snapshot / f"bm25-{hybrid['bm25_k1']}-{hybrid['bm25_b']}.pkl" if snapshot else None
+        if path is not None and path.exists():
+            try:
+                with open(path, "rb") as f:
+                    return pickle.load(f)
+            except Exception as e:
+                print(f"⚠️ Índice BM25 inválido, reconstruyendo: {e}")
+        
+        sparse_index = BM25Index.from_vectorstore(vectorstore, hybrid["bm25_k1"], hybrid["bm25_b"])
+        if path is not None:
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".pkl")
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(sparse_index, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"⚠️ No se pudo guardar el índice BM25: {e}")
+        return sparse_index
+    
+    def _split_file(self, file: Path) -> Tuple[List["Document"], Dict[str, str]]:
+        """Divide un archivo markdown en chunks; devuelve también sus secciones padre por parent_id"""
+        from langchain_community.document_loaders import TextLoader
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        
+        from age_bands import chunk_age_bands, section_heading
+        from section_chunks import split_hierarchical
+        
+        documents = TextLoader(str(file), encoding="utf-8").load()
+        chunking = RAG_CONFIG["chunking"]
+        if chunking["mode"] == "hierarchical":
+            # Small-to-big: se buscan párrafos chicos y al LLM llega su sección completa
+            source_id = file.relative_to(self.knowledge_dir).as_posix()
+            chunks = [child for document in documents
+                      for child in split_hierarchical(document, chunking["child_size"], chunking["parent_max"],
+                                                      source_id=source_id)]
+        else:
+            text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=RAG_CONFIG["chunk_size"],
+                chunk_overlap=RAG_CONFIG["chunk_overlap"],
+                separators=RAG_CONFIG["separators"],
+                length_function=len,
+                is_separator_regex=False,
+                add_start_index=True
+            )
+            chunks = text_splitter.split_documents(documents)
+        
+        # Cita precalculada; el texto del padre se guarda una vez por sección, no en cada hijo
+        citation = chunk_citation(str(file))
+        text = documents[0].page_content if documents else ""
+        parents = {}
+        for chunk in chunks:
+            parent_content = chunk.metadata.pop("parent_content", None)
+            if parent_content is not None:
+                parents[chunk.metadata["parent_id"]] = parent_content
+            chunk.metadata["citation"] = citation
+            # Bandas etarias de los encabezados del chunk ("### Infants 0-3 months"), no del cuerpo
+            chunk.metadata.setdefault("section", section_heading(text, chunk.metadata["start_index"]))
+            chunk.metadata["age_bands"] = chunk_age_bands(chunk.metadata["section"], chunk.page_content)
+        return chunks, parents
+    
+    def _read_manifest(self) -> dict:
+        """Lee el manifest {archivo: {sha256, chunk_ids}} del índice en disco"""
+        try:
+            return json.loads((self.index_dir / MANIFEST_FILE).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {"files": {}}
+    
+    def _load_snapshot(self, snapshot: Optional[str], mmap: bool = False) -> Optional["FAISS"]:
+        """Carga el índice y docstore de un snapshot guardado"""
+        from langchain_community.vectorstores import FAISS
+        
+        if not snapshot or not (self.index_dir / snapshot / "index.faiss").exists():
+            return None
+        try:
+            if mmap:
+                return self._load_snapshot_mmap(self.index_dir / snapshot)
+            # El pickle del docstore lo escribe este mismo proceso (_save_snapshot)
+            return FAISS.load_local(
+                str(self.index_dir / snapshot),
+                self.embeddings,
+                allow_dangerous_deserialization=True
+            )
+        except Exception as e:
+            print(f"⚠️ Caché de índice inválida en {self.index_dir}, reconstruyendo: {e}")
+            return None
+    
+    def _load_parents(self, snapshot: Optional[str]) -> Optional[Dict[str, str]]:
+        """Secciones padre de un snapshot guardado, o None si faltan o son inválidas"""
+        if not snapshot:
+            return None
+        try:
+            return json.loads((self.index_dir / snapshot / PARENTS_FILE).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+    
+    def _load_snapshot_mmap(self, path: Path) -> "FAISS":
+        """Mapea index.faiss en memoria de solo lectura
+        
+        Los vectores no se copian al heap del proceso: todos los workers del nodo
+        comparten las mismas páginas físicas a través del page cache del sistema.
+        """
+        from langchain_community.vectorstores import FAISS
+        from ann_index import read_index
+        
+        index = read_index(path / "index.faiss", mmap=True)
+        with open(path / "index.pkl", "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        return FAISS(self.embeddings, index, docstore, index_to_docstore_id)
+    
+    def _save_snapshot(self, vectorstore: "FAISS", files: Dict[str, dict],
+                       parents: Dict[str, str]) -> Optional[str]:
+        """Guarda un snapshot nuevo y publica el manifest de forma atómica
+        
+        Varios workers pueden re-indexar a la vez: cada snapshot es un directorio
+        inmutable (escrito una vez, luego solo se mapea) y el manifest solo se
+        reemplaza con os.replace. Devuelve el nombre del snapshot o None si falló.
+        """
+        snapshot = hashlib.sha256(json.dumps(
+            {path: entry["sha256"] for path, entry in files.items()}, sort_keys=True
+        ).encode("utf-8")).hexdigest()[:16]
+        try:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = Path(tempfile.mkdtemp(dir=self.index_dir, prefix=".tmp-"))
+            vectorstore.save_local(str(tmp_path))
+            (tmp_path / PARENTS_FILE).write_text(json.dumps(parents, ensure_ascii=False), encoding="utf-8")
+            try:
+                os.replace(tmp_path, self.index_dir / snapshot)
+            except OSError:
+                # Otro proceso ya publicó el mismo snapshot
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            
+            manifest_tmp = self.index_dir / f".{MANIFEST_FILE}.{os.getpid()}"
+            manifest_tmp.write_text(json.dumps(
+                {"version": INDEX_CACHE_VERSION, "embedding_model": self.embedding_model,
+                 "snapshot": snapshot, "files": files},
+                indent=2
+            ), encoding="utf-8")
+            os.replace(manifest_tmp, self.index_dir / MANIFEST_FILE)
+            
+            # Borrar snapshots anteriores (los procesos que ya los mapearon conservan sus páginas)
+            for old in self.index_dir.iterdir():
+                if old.is_dir() and old.name != snapshot and not old.name.startswith("."):
+                    shutil.rmtree(old, ignore_errors=True)
+        except OSError as e:
+            # Sin disco escribible seguimos funcionando con el índice en memoria
+            print(f"⚠️ No se pudo guardar la caché del índice: {e}")
+            return None
+        return snapshot
+    
+    def get_sources(self) -> List[str]:
+        """Retorna lista de fuentes cargadas"""
+        sources = []
+        for file in self.knowledge_dir.glob("**/*.md"):
+            sources.append(file.name)
+        return sources
+
+
+def chunk_citation(source_path: str) -> str:
+    """Cita de un archivo: "[Título](URL)" si es una fuente oficial, si no el nombre del archivo"""
+    # Extraer nombre del archivo
+    source_file = Path(source_path).name if source_path != "Unknown" else "Unknown"
+    if source_file in SOURCE_URLS:
+        title, url = SOURCE_URLS[source_file]
+        return f"[{title}]({url})"
+    return source_file
+
+
+def embedding_model_for(provider: str) -> str:
+    """Modelo de embeddings usado por un proveedor de LLM"""
+    return EMBEDDING_MODELS.get(provider, EMBEDDING_MODELS["openai"])
+
+
+# Un índice por (base de conocimiento, modelo de embeddings): idioma y LLM no lo afectan
+_INDEXES = SharedRegistry(RAG_CONFIG["shared_registry_size"])
+_RERANKERS = SharedRegistry()
+_WARMUPS: Dict[tuple, threading.Thread] = {}
+_WARMUP_LOCK = threading.Lock()
+
+
+def get_shared_reranker(model_name: str, budget_ms: float):
+    """Un cross-encoder por proceso (el modelo se carga una sola vez, en segundo plano)"""
+    from reranker import CrossEncoderReranker
+    
+    return _RERANKERS.get_or_create((model_name, budget_ms), lambda: CrossEncoderReranker(model_name, budget_ms))
+
+
+def _index_key(knowledge_dir: str, provider: str, api_key: str, index_cache_dir: Optional[str]) -> tuple:
+    key = (str(Path(knowledge_dir).resolve()), embedding_model_for(provider), index_cache_dir)
+    if provider != "cerebras":
+        # Los embeddings de OpenAI necesitan la key del usuario para vectorizar consultas
+        key += (hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16],)
+    return key
+
+
+def get_shared_index(knowledge_dir: str = "knowledge", provider: str = "openai", api_key: str = "",
+                     index_cache_dir: Optional[str] = None) -> KnowledgeIndex:
+    """Devuelve el índice compartido del proceso para esta base de conocimiento y embeddings"""
+    return _INDEXES.get_or_create(
+        _index_key(knowledge_dir, provider, api_key, index_cache_dir),
+        lambda: KnowledgeIndex(knowledge_dir, provider, api_key, index_cache_dir)
+    )
+
+
+def warm_up_shared_index(knowledge_dir: str = "knowledge", provider: str = "openai", api_key: str = "",
+                         index_cache_dir: Optional[str] = None) -> Optional[threading.Thread]:
+    """Carga modelo de embeddings e índice en un hilo de fondo mientras la UI se renderiza
+    
+    El primer get_shared_index() de la misma configuración espera a este hilo en vez de
+    construir el índice otra vez. Devuelve None si el índice ya estaba cargado.
+    """
+    key = _index_key(knowledge_dir, provider, api_key, index_cache_dir)
+    if key in _INDEXES:
+        return None
+    with _WARMUP_LOCK:
+        thread = _WARMUPS.get(key)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(
+                target=_warm_up,
+                args=(key, knowledge_dir, provider, api_key, index_cache_dir),
+                name="pedisafe-warmup",
+                daemon=True
+            )
+            _WARMUPS[key] = thread
+            thread.start()
+    return thread
+
+
+def _warm_up(key: tuple, knowledge_dir: str, provider: str, api_key: str, index_cache_dir: Optional[str]):
+    start = time.perf_counter()
+    try:
+        # El front-end de generación también lo necesitará
+        import langchain_openai  # noqa: F401
+        get_shared_index(knowledge_dir, provider, api_key, index_cache_dir)
+    except Exception as e:
+        # El primer uso en primer plano reintenta y muestra el error al usuario
+        print(f"⚠️ Falló la precarga del índice (se reintentará al usarlo): {e}")
+        return
+    finally:
+        # Un hilo terminado no se guarda: con muchas API keys el dict crecería sin límite
+        with _WARMUP_LOCK:
+            if _WARMUPS.get(key) is threading.current_thread():
+                del _WARMUPS[key]
+    print(f"🔥 Índice precargado en segundo plano en {time.perf_counter() - start:.1f}s")
+
+
+def clear_shared_indexes():
+    """Vacía el registro de índices (tests o recarga de la base de conocimiento)"""
+    _INDEXES.clear()
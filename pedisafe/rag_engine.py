@@ -3,104 +3,64 @@ PediSafe RAG Engine
 Motor de Generación Aumentada por Recuperación usando FAISS (gratuito)
 """
 
-import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_core.documents import Document
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
+from config import get_system_prompt, get_rag_template, EMERGENCY_SOURCES, RAG_CONFIG, SOURCE_URLS
+from i18n import get_text, get_triage_level_text
+from knowledge_index import (KnowledgeIndex, SharedRegistry, chunk_citation, get_shared_index,
+                             clear_shared_indexes)
+from response_cache import ResponseCache
+from triage import check_emergency, check_red_flags, current_rules, extract_age_temp
 
-from config import get_system_prompt, get_rag_template, TRIAGE_RULES
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
 
 class PediSafeRAG:
-    """Motor RAG para el asistente de triaje pediátrico"""
+    """Motor RAG para el asistente de triaje pediátrico
     
-    def __init__(self, api_key: str, knowledge_dir: str = "knowledge", language: str = "en", provider: str = "openai"):
+    Front-end de generación (LLM + prompt por idioma) sobre un KnowledgeIndex compartido:
+    cambiar de idioma o proveedor de LLM no vuelve a vectorizar la base de conocimiento.
+    """
+    
+    def __init__(self, api_key: str, knowledge_dir: str = "knowledge", language: str = "en", provider: str = "openai",
+                 index_cache_dir: Optional[str] = None, index: Optional[KnowledgeIndex] = None):
         self.api_key = api_key
         self.knowledge_dir = Path(knowledge_dir)
         self.language = language
         self.provider = provider
-        self.vectorstore = None
-        self.retriever = None
         self.chain = None
+        self._context_cache: "OrderedDict[tuple, str]" = OrderedDict()
+        self._context_lock = threading.Lock()
+        
+        # Capa de recuperación compartida (embeddings + FAISS)
+        self.index = index or get_shared_index(knowledge_dir, provider, api_key, index_cache_dir)
+        self.embeddings = self.index.embeddings
         
         # Initialize components
-        self._setup_embeddings()
-        self._load_knowledge_base()
         self._setup_chain()
+        self._setup_emergency_response()
     
-    def _setup_embeddings(self):
-        """Configura embeddings según el proveedor"""
-        if self.provider == "cerebras":
-            # Cerebras no tiene embeddings propios
-            # Usar Hugging Face embeddings (100% GRATIS, sin API key necesaria)
-            print("🆓 Usando embeddings gratuitos de Hugging Face (sentence-transformers)")
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/all-MiniLM-L6-v2",
-                model_kwargs={'device': 'cpu'},
-                encode_kwargs={'normalize_embeddings': True}
-            )
-        else:
-            self.embeddings = OpenAIEmbeddings(
-                api_key=self.api_key,
-                model="text-embedding-3-small"  # Más barato: $0.02/1M tokens
-            )
+    @property
+    def vectorstore(self):
+        # Siempre el índice publicado más reciente (KnowledgeIndex.refresh lo reemplaza)
+        return self.index.vectorstore
     
-    def _load_knowledge_base(self):
-        """Carga y vectoriza los documentos de conocimiento con estrategia optimizada"""
-        # Load markdown files
-        loader = DirectoryLoader(
-            str(self.knowledge_dir),
-            glob="**/*.md",
-            loader_cls=TextLoader,
-            loader_kwargs={"encoding": "utf-8"}
-        )
-        documents = loader.load()
-        
-        # RAG Best Practice: Hierarchical chunking con overlap adecuado
-        # chunk_size: 800-1200 tokens es óptimo para medical context
-        # overlap: 150-250 para preservar contexto entre chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,  # Tamaño óptimo para contexto médico
-            chunk_overlap=200,  # 20% overlap para coherencia
-            separators=[
-                "\n## ",      # Secciones principales (H2)
-                "\n### ",     # Subsecciones (H3)
-                "\n#### ",    # Sub-subsecciones (H4)
-                "\n\n",       # Párrafos
-                "\n",         # Líneas
-                ". ",         # Oraciones
-                " "           # Palabras (último recurso)
-            ],
-            length_function=len,
-            is_separator_regex=False
-        )
-        splits = text_splitter.split_documents(documents)
-        
-        # RAG Best Practice: FAISS con IndexFlatL2 para búsqueda exacta
-        self.vectorstore = FAISS.from_documents(splits, self.embeddings)
-        
-        # RAG Best Practice: Hybrid search con MMR para diversidad
-        # MMR (Maximal Marginal Relevance) reduce redundancia en resultados
-        self.retriever = self.vectorstore.as_retriever(
-            search_type="mmr",  # MMR en lugar de similarity para mayor diversidad
-            search_kwargs={
-                "k": 6,              # Top 6 chunks (mejor cobertura)
-                "fetch_k": 20,       # Fetch 20, luego MMR selecciona 6
-                "lambda_mult": 0.7   # Balance relevancia (1.0) vs diversidad (0.0)
-            }
-        )
+    @property
+    def retriever(self):
+        return self.index.retriever
     
     def _setup_chain(self):
         """Configura la cadena RAG con LangChain"""
+        # Imports diferidos: LangChain y el SDK de OpenAI solo se cargan al crear el primer motor
+        from langchain_core.prompts import ChatPromptTemplate
+        from langchain_openai import ChatOpenAI
+        
         if self.provider == "cerebras":
             # Cerebras API es compatible con OpenAI SDK
             llm = ChatOpenAI(
@@ -128,119 +88,110 @@ class PediSafeRAG:
         self.llm = llm
         self.prompt = prompt
     
-    def _format_docs(self, docs: List[Document]) -> str:
-        """Formatea documentos recuperados para el contexto con URLs específicas"""
-        import re
-        formatted = []
+    def _setup_emergency_response(self):
+        """Precalcula la respuesta ROJO localizada con sus fuentes (solo falta la señal detectada)"""
+        red = get_triage_level_text("RED", self.language)
+        sources = "\n".join(f"- [{title}]({url})" for title, url in
+                            (SOURCE_URLS[source_file] for source_file in EMERGENCY_SOURCES))
+        self._emergency_template = get_text("emergency_response", self.language).format(
+            description=red["description"], action=red["action"], sources=sources, flag="{flag}"
+        )
+    
+    def _format_docs(self, docs: List["Document"]) -> str:
+        """Formatea documentos recuperados para el contexto con URLs específicas
         
-        # Map de archivos a URLs específicas - SOLO fuentes oficiales AAP/NHS
-        # NO incluir documentos internos consolidados o ejemplos
-        source_urls = {
-            "aap_fever_baby.md": ("Fever and Your Baby - AAP", "https://www.healthychildren.org/English/health-issues/conditions/fever/Pages/Fever-and-Your-Baby.aspx"),
-            "aap_fever_without_fear.md": ("Fever Without Fear - AAP", "https://www.healthychildren.org/English/health-issues/conditions/fever/Pages/Fever-Without-Fear.aspx"),
-            "aap_symptom_checker.md": ("Symptom Checker: Fever - AAP", "https://www.healthychildren.org/English/tips-tools/symptom-checker/Pages/symptomviewer.aspx?symptom=Fever+(0-12+Months)"),
-            "aap_when_to_call.md": ("When to Call the Pediatrician - AAP", "https://www.healthychildren.org/English/health-issues/conditions/fever/Pages/When-to-Call-the-Pediatrician.aspx"),
-            "nhs_fever_children.md": ("High Temperature in Children - NHS", "https://www.nhs.uk/conditions/fever-in-children/"),
-        }
+        Cada hijo se expande al texto de su sección, guardado una sola vez en el índice por
+        parent_id; el contexto completo se cachea por la tupla de ids (MMR suele repetir la
+        misma selección).
+        """
+        key = tuple(doc.id for doc in docs)
+        cacheable = None not in key
+        if cacheable:
+            with self._context_lock:
+                context = self._context_cache.get(key)
+                if context is not None:
+                    self._context_cache.move_to_end(key)
+                    return context
         
-        for i, doc in enumerate(docs, 1):
-            source_path = doc.metadata.get("source", "Unknown")
-            # Extraer nombre del archivo
-            source_file = Path(source_path).name if source_path != "Unknown" else "Unknown"
-            
-            # Obtener título y URL específica
-            if source_file in source_urls:
-                title, url = source_urls[source_file]
-                source_info = f"[{title}]({url})"
-            else:
-                source_info = source_file
-            
-            formatted.append(f"[Fragment {i}] Source: {source_info}\n{doc.page_content}")
+        # Varios hijos de la misma sección se expanden a un solo bloque del padre
+        parents = self.index.parents
+        blocks, seen = [], set()
+        for doc in docs:
+            parent_id = doc.metadata.get("parent_id") or doc.id
+            if parent_id is not None:
+                if parent_id in seen:
+                    continue
+                seen.add(parent_id)
+            blocks.append(self._context_block(doc, parents.get(parent_id)))
+        context = "\n\n---\n\n".join(f"[Fragment {i}] {block}" for i, block in enumerate(blocks, 1))
         
-        return "\n\n---\n\n".join(formatted)
+        if cacheable:
+            with self._context_lock:
+                self._context_cache[key] = context
+                while len(self._context_cache) > RAG_CONFIG["context_cache_size"]:
+                    self._context_cache.popitem(last=False)
+        return context
+    
+    @staticmethod
+    def _context_block(doc: "Document", parent_content: Optional[str] = None) -> str:
+        """"Source: ...\n<texto>": la sección padre si la hay, si no el propio chunk"""
+        citation = doc.metadata.get("citation") or chunk_citation(doc.metadata.get("source", "Unknown"))
+        return f"Source: {citation}\n{parent_content if parent_content is not None else doc.page_content}"
     
     def _check_red_flags(self, message: str) -> Tuple[bool, str]:
         """Capa A: Verificación determinista de señales de alarma"""
-        message_lower = message.lower()
-        
-        # CRÍTICO: Verificar edad + fiebre ANTES de buscar red flags textuales
-        age_temp_data = self._extract_age_temp(message)
-        
-        # Regla AAP: CUALQUIER fiebre en <3 meses es EMERGENCIA
-        if age_temp_data["age_months"] is not None and age_temp_data["temp_c"] is not None:
-            age_months = age_temp_data["age_months"]
-            temp_c = age_temp_data["temp_c"]
-            
-            # <3 meses con temp >= 38.0°C = RED FLAG automático
-            if age_months < 3 and temp_c >= 38.0:
-                return True, f"bebé <3 meses con fiebre {temp_c}°C"
-            
-            # 3-6 meses con temp >= 39.0°C = RED FLAG
-            if 3 <= age_months < 6 and temp_c >= 39.0:
-                return True, f"bebé 3-6 meses con fiebre alta {temp_c}°C"
-        
-        # Buscar red flags textuales (síntomas críticos)
-        for flag in TRIAGE_RULES["red_flags"]:
-            if flag.lower() in message_lower:
-                return True, flag
-        
-        return False, ""
+        return check_red_flags(message, self.language)
+    
+    def _check_emergency(self, message: str) -> Tuple[bool, str]:
+        """Capa A: solo señales ROJO, las que se responden sin retrieval ni LLM"""
+        return check_emergency(message, self.language)
     
     def _extract_age_temp(self, message: str) -> dict:
         """Extrae edad y temperatura del mensaje con alta precisión"""
-        import re
-        
-        result = {"age_months": None, "temp_c": None}
-        message_lower = message.lower()
-        
-        # Buscar edad - PRIORIDAD: meses explícitos
-        age_patterns = [
-            (r"(\d+)\s*meses?", 1),           # "8 meses" -> meses
-            (r"(\d+)\s*months?", 1),          # "8 months" -> meses
-            (r"(\d+)\s*años?", 12),           # "3 años" -> 36 meses
-            (r"(\d+)\s*years?", 12),          # "3 years" -> 36 meses
-            (r"(\d+)\s*semanas?", 0.25),      # "4 semanas" -> 1 mes
-            (r"(\d+)\s*weeks?", 0.25),        # "4 weeks" -> 1 mes
-            (r"bebé?\s*de\s*(\d+)", 1),       # "bebé de 2" -> 2 meses
-            (r"(\d+)[-\s]?(month|mes)", 1),   # "2-month" -> 2 meses
-        ]
-        
-        for pattern, multiplier in age_patterns:
-            match = re.search(pattern, message_lower)
-            if match:
-                age_value = float(match.group(1))
-                result["age_months"] = int(age_value * multiplier)
-                break
-        
-        # Buscar temperatura con múltiples formatos
-        temp_patterns = [
-            r"(\d+\.?\d*)\s*°?\s*[cC](?:\s|,|$)",  # 38.5°C o 38.5 C
-            r"(\d+\.?\d*)\s*grados",                # 38.5 grados
-            r"temperatura\s*:?\s*(\d+\.?\d*)",      # temperatura: 38.5
-            r"(\d+\.?\d*)\s*°?\s*[fF]",             # 101°F (Fahrenheit)
-            r"temp\w*\s*:?\s*(\d+\.?\d*)",          # temp: 38.5
-        ]
-        
-        for pattern in temp_patterns:
-            match = re.search(pattern, message_lower)
-            if match:
-                temp = float(match.group(1))
-                # Detectar y convertir Fahrenheit
-                if temp > 45 or 'f' in pattern.lower():
-                    temp = (temp - 32) * 5/9
-                result["temp_c"] = round(temp, 1)
-                break
-        
-        return result
+        return extract_age_temp(message)
     
     def get_response(self, user_message: str, chat_history: str = "") -> str:
         """Genera respuesta usando RAG"""
         
         # Capa A: Verificar red flags primero
         has_red_flag, flag_found = self._check_red_flags(user_message)
+        if has_red_flag and RAG_CONFIG["emergency_fast_path"]["enabled"]:
+            # Emergencia determinista: ROJO inmediato, sin esperar retrieval ni LLM. Las señales
+            # de menor nivel (fiebre alta 3-6 meses) siguen al LLM con la alerta
+            is_emergency, emergency_flag = self._check_emergency(user_message)
+            if is_emergency:
+                return self._emergency_template.format(flag=emergency_flag)
+        return self._generate(user_message, chat_history, has_red_flag, flag_found)
+    
+    def get_emergency_response(self, user_message: str) -> Optional[str]:
+        """Respuesta ROJO precalculada si la Capa A detecta una señal de nivel ROJO, si no None"""
+        if not RAG_CONFIG["emergency_fast_path"]["enabled"]:
+            return None
+        is_emergency, flag_found = self._check_emergency(user_message)
+        return self._emergency_template.format(flag=flag_found) if is_emergency else None
+    
+    def elaborate_emergency(self, user_message: str, chat_history: str = "") -> "Future[str]":
+        """Respuesta RAG + LLM completa de una emergencia, generada en segundo plano
         
-        # Recuperar documentos relevantes
-        docs = self.retriever.invoke(user_message)
+        Complementa (nunca reemplaza) la respuesta ROJO inmediata de get_emergency_response.
+        """
+        has_red_flag, flag_found = self._check_red_flags(user_message)
+        return _elaboration_pool().submit(self._generate, user_message, chat_history, has_red_flag, flag_found)
+    
+    def _generate(self, user_message: str, chat_history: str, has_red_flag: bool, flag_found: str) -> str:
+        """Capa B: retrieval + LLM"""
+        # Caché semántica: la misma pregunta (casi) idéntica no vuelve a llamar al LLM
+        cache_key = query_vector = None
+        if RAG_CONFIG["response_cache"]["enabled"]:
+            cache_key = self._response_cache_key(user_message, chat_history, has_red_flag, flag_found)
+            query_vector = self.embeddings.embed_query(user_message)
+            cached = _RESPONSES.get(cache_key, query_vector)
+            if cached is not None:
+                print("💾 Respuesta servida desde la caché semántica")
+                return cached
+        
+        # Recuperar documentos relevantes (filtrados por la banda etaria del mensaje)
+        docs = self.index.retrieve(user_message, self._extract_age_temp(user_message)["age_months"])
         context = self._format_docs(docs)
         
         # Preparar el prompt
@@ -258,14 +209,81 @@ class PediSafeRAG:
         
         response = self.llm.invoke(messages)
         
+        if cache_key is not None:
+            _RESPONSES.put(cache_key, user_message, query_vector, response.content)
         return response.content
     
+    def _response_cache_key(self, user_message: str, chat_history: str, has_red_flag: bool,
+                            flag_found: str) -> tuple:
+        """Parte exacta de la clave: todo lo que cambia la respuesta aunque el texto sea parecido
+        
+        Incluye la versión del índice y de las reglas de triage: tras un refresh de knowledge/
+        o una recarga de triage_rules.json no se sirven respuestas generadas con los anteriores.
+        """
+        age_temp = self._extract_age_temp(user_message)
+        history_digest = hashlib.sha256(chat_history.encode("utf-8")).hexdigest()[:16]
+        return (self.language, self.provider, self.index.version, current_rules().version,
+                has_red_flag, flag_found, age_temp["age_months"], age_temp["temp_c"], history_digest)
+    
+    def retrieve_batch(self, messages: List[str]) -> List[List["Document"]]:
+        """Chunks recuperados para muchos mensajes (auditorías / evaluación offline), sin LLM
+        
+        Mismo filtrado por edad que get_response, con embeddings en lote y una sola búsqueda FAISS.
+        """
+        ages = [self._extract_age_temp(message)["age_months"] for message in messages]
+        return self.index.retrieve_batch(messages, ages)
+    
     def get_sources(self) -> List[str]:
         """Retorna lista de fuentes cargadas"""
-        sources = []
-        for file in self.knowledge_dir.glob("**/*.md"):
-            sources.append(file.name)
-        return sources
+        return self.index.get_sources()
+
+
+# Registro de front-ends a nivel de proceso: uno por (proveedor, idioma, API key).
+# Son baratos (solo prompt + cliente LLM) porque todos comparten el mismo KnowledgeIndex,
+# así que cambiar de idioma o proveedor es un intercambio de referencia, no una reindexación
+_ENGINES = SharedRegistry(2 * RAG_CONFIG["shared_registry_size"])
+
+# Respuestas compartidas por todos los motores (la clave incluye idioma, proveedor y versiones de índice y reglas)
+_RESPONSES = ResponseCache(
+    RAG_CONFIG["response_cache"]["similarity"],
+    RAG_CONFIG["response_cache"]["ttl_seconds"],
+    RAG_CONFIG["response_cache"]["max_entries"],
+)
+
+
+# Elaboraciones de emergencia en segundo plano (el pool se crea al primer uso)
+_ELABORATION_POOL: Optional[ThreadPoolExecutor] = None
+_ELABORATION_LOCK = threading.Lock()
+
+
+def _elaboration_pool() -> ThreadPoolExecutor:
+    global _ELABORATION_POOL
+    with _ELABORATION_LOCK:
+        if _ELABORATION_POOL is None:
+            _ELABORATION_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pedisafe-elaborate")
+    return _ELABORATION_POOL
+
+
+def _engine_key(api_key: str, knowledge_dir: str, language: str, provider: str) -> tuple:
+    """Clave del registro (la API key se guarda solo como hash)"""
+    key_digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    return (str(Path(knowledge_dir).resolve()), language, provider, key_digest)
+
+
+def get_shared_engine(api_key: str, knowledge_dir: str = "knowledge", language: str = "en",
+                      provider: str = "openai") -> PediSafeRAG:
+    """Devuelve el motor compartido del proceso, construyéndolo una sola vez por configuración"""
+    return _ENGINES.get_or_create(
+        _engine_key(api_key, knowledge_dir, language, provider),
+        lambda: PediSafeRAG(api_key, knowledge_dir, language, provider)
+    )
+
+
+def clear_shared_engines():
+    """Vacía los registros de motores, índices y respuestas (tests o recarga de la base de conocimiento)"""
+    _ENGINES.clear()
+    _RESPONSES.clear()
+    clear_shared_indexes()
 
 
 def test_rag_engine():
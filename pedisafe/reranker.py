@@ -0,0 +1,67 @@
+"""
+PediSafe Reranker
+Re-ranking opcional con un cross-encoder en CPU, acotado por un presupuesto de tiempo
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import List, Optional
+
+
+class CrossEncoderReranker:
+    """Puntúa pares (consulta, chunk) en un solo lote con un cross-encoder
+    
+    El modelo se carga en un hilo de fondo: mientras no esté listo, o si el lote no
+    termina dentro de `budget_ms`, score() devuelve None y se mantiene el orden MMR.
+    Un solo worker: en CPU los lotes concurrentes solo se estorbarían. Un lote vencido
+    no se puede interrumpir; mientras siga corriendo score() devuelve None sin encolar
+    otro, así la cola no crece cuando el modelo es más lento que el presupuesto.
+    """
+    
+    def __init__(self, model_name: str, budget_ms: float = 150, model=None):
+        self.model_name = model_name
+        self.budget_ms = budget_ms
+        self.model = model
+        self.timeouts = 0
+        self.skipped = 0
+        self._overdue: Optional[Future] = None  # Último lote que superó el presupuesto
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pedisafe-rerank")
+        self._loader = None
+        if model is None:
+            self._loader = threading.Thread(target=self._load, name="pedisafe-rerank-load", daemon=True)
+            self._loader.start()
+    
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            from sentence_transformers import CrossEncoder
+            self.model = CrossEncoder(self.model_name, device="cpu")
+        except Exception as e:
+            # Sin sentence-transformers (o sin el modelo) el re-ranking queda desactivado
+            print(f"⚠️ Reranker no disponible, se usa el orden MMR: {e}")
+            return
+        print(f"🎯 Reranker {self.model_name} cargado en {time.perf_counter() - start:.1f}s")
+    
+    @property
+    def ready(self) -> bool:
+        return self.model is not None
+    
+    def score(self, query: str, texts: List[str]) -> Optional[List[float]]:
+        """Scores de relevancia de cada texto, o None si no hay modelo o se agotó el presupuesto"""
+        if not self.ready or not texts:
+            return None
+        overdue = self._overdue
+        if overdue is not None and not overdue.done():
+            self.skipped += 1
+            return None
+        future = self._pool.submit(self.model.predict, [(query, text) for text in texts])
+        try:
+            return [float(score) for score in future.result(timeout=self.budget_ms / 1000)]
+        except FutureTimeout:
+            # Si todavía estaba en cola no llega a correr; si ya corre, bloquea el worker
+            if not future.cancel():
+                self._overdue = future
+            self.timeouts += 1
+            print(f"⏱️ Reranker superó {self.budget_ms:.0f} ms, se usa el orden MMR")
+            return None
@@ -0,0 +1,102 @@
+"""
+PediSafe Response Cache
+Caché semántica de respuestas del LLM con TTL y desalojo LRU
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class _Entry:
+    vector: np.ndarray
+    response: str
+    expires_at: float
+
+
+class ResponseCache:
+    """Respuestas ya generadas, reutilizadas para consultas casi idénticas
+    
+    La clave exacta agrupa lo que cambia la respuesta aunque el texto se parezca
+    (idioma, proveedor, resultado de la Capa A, edad/temperatura extraídas, historial);
+    dentro de un grupo se busca la consulta más parecida por similitud coseno de su
+    embedding y solo se reutiliza si supera `threshold`.
+    """
+    
+    def __init__(self, threshold: float = 0.95, ttl_seconds: float = 3600, max_entries: int = 512):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Orden LRU global + índice por clave exacta para comparar solo dentro del grupo
+        self._entries: "OrderedDict[Tuple[tuple, str], _Entry]" = OrderedDict()
+        self._buckets: Dict[tuple, Dict[str, _Entry]] = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    def get(self, key: tuple, query_vector: List[float]) -> Optional[str]:
+        """Respuesta cacheada para `key` cuya consulta tenga similitud >= threshold"""
+        vector = self._normalize(query_vector)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key, {})
+            for text in [text for text, entry in bucket.items() if entry.expires_at <= now]:
+                self._remove(key, text)
+            
+            if bucket:
+                texts = list(bucket)
+                scores = np.stack([bucket[text].vector for text in texts]) @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end((key, texts[best]))
+                    self.hits += 1
+                    return bucket[texts[best]].response
+            self.misses += 1
+            return None
+    
+    def put(self, key: tuple, query: str, query_vector: List[float], response: str):
+        """Guarda una respuesta; desaloja las menos usadas si se supera max_entries"""
+        entry = _Entry(self._normalize(query_vector), response, time.monotonic() + self.ttl_seconds)
+        with self._lock:
+            self._entries[(key, query)] = entry
+            self._entries.move_to_end((key, query))
+            self._buckets.setdefault(key, {})[query] = entry
+            while len(self._entries) > self.max_entries:
+                (old_key, old_query), _ = next(iter(self._entries.items()))
+                self._remove(old_key, old_query)
+    
+    def _remove(self, key: tuple, query: str):
+        self._entries.pop((key, query), None)
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.pop(query, None)
+            if not bucket:
+                del self._buckets[key]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
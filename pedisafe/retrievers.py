@@ -0,0 +1,196 @@
+"""
+PediSafe Retrievers
+MMR vectorizado con NumPy sobre vectores cacheados, recuperación híbrida
+(MMR denso + BM25 fusionados con reciprocal rank fusion) y re-ranking con cross-encoder
+"""
+
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from bm25_index import BM25Index
+
+
+def mmr_select(query_sims: np.ndarray, pairwise: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """Maximal Marginal Relevance sobre candidatos ya puntuados
+    
+    Misma selección que langchain (maximal_marginal_relevance), pero en vez de recalcular
+    la similitud contra todos los elegidos en cada paso se mantiene el máximo acumulado:
+    cada iteración es una operación vectorial sobre fetch_k candidatos.
+    """
+    n = len(query_sims)
+    if n == 0 or k <= 0:
+        return []
+    selected = [int(np.argmax(query_sims))]
+    redundancy = pairwise[selected[0]].astype(np.float32, copy=True)
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(k, n):
+        scores = lambda_mult * query_sims - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, pairwise[best], out=redundancy)
+    return selected
+
+
+class VectorizedMMRRetriever(BaseRetriever):
+    """MMR denso sobre una matriz de vectores normalizados cacheada al cargar el índice
+    
+    La búsqueda de los fetch_k candidatos usa el índice servido (plano, IVF, HNSW...);
+    las similitudes consulta-chunk salen de un producto matriz-vector y las chunk-chunk
+    de la matriz precalculada en la ingesta (o de un producto fetch_k x fetch_k).
+    """
+    
+    vectorstore: Any  # FAISS servido: índice de búsqueda + docstore
+    vectors: Any  # np.ndarray (n, d) float32 normalizado, mismo orden que el índice
+    gram: Optional[Any] = None  # np.ndarray (n, n) de similitudes coseno entre chunks
+    age_masks: Optional[Any] = None  # np.ndarray (n,) bits de bandas etarias por chunk (0 = general)
+    k: int = 6
+    fetch_k: int = 20
+    age_fetch_k: int = 12  # Candidatos que llegan al MMR cuando se filtra por edad
+    pad_k: Optional[int] = None  # Mínimo de chunks con filtro por edad (None = k); ver _filter_age
+    lambda_mult: float = 0.7
+    
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                age_band: Optional[str] = None) -> List[Document]:
+        query_vector = np.asarray(self.vectorstore.embedding_function.embed_query(query), dtype=np.float32)
+        return self.select(query_vector, age_band)
+    
+    def select(self, query_vector: np.ndarray, age_band: Optional[str] = None) -> List[Document]:
+        """Documentos MMR para un vector de consulta ya calculado"""
+        _, indices = self.vectorstore.index.search(query_vector[None, :], self.fetch_k)
+        return self._select_candidates(query_vector, indices[0], age_band)
+    
+    def batch_select(self, queries: List[str], query_vectors: np.ndarray,
+                     age_bands: List[Optional[str]]) -> List[List[Document]]:
+        """Una sola búsqueda FAISS matricial para todas las consultas, luego MMR por fila"""
+        query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        _, indices = self.vectorstore.index.search(query_vectors, self.fetch_k)
+        return [self._select_candidates(vector, row, age_band)
+                for vector, row, age_band in zip(query_vectors, indices, age_bands)]
+    
+    def _select_candidates(self, query_vector: np.ndarray, indices: np.ndarray,
+                           age_band: Optional[str]) -> List[Document]:
+        ids = indices[indices != -1]
+        if age_band is not None and self.age_masks is not None:
+            ids = self._filter_age(ids, age_band)
+        if len(ids) == 0:
+            return []
+        
+        norm = np.linalg.norm(query_vector)
+        candidates = np.asarray(self.vectors[ids], dtype=np.float32)
+        query_sims = candidates @ (query_vector / norm if norm > 0 else query_vector)
+        pairwise = self.gram[np.ix_(ids, ids)] if self.gram is not None else candidates @ candidates.T
+        
+        docstore, mapping = self.vectorstore.docstore, self.vectorstore.index_to_docstore_id
+        return [docstore.search(mapping[int(ids[i])])
+                for i in mmr_select(query_sims, pairwise, self.k, self.lambda_mult)]
+    
+    def _filter_age(self, ids: np.ndarray, age_band: str) -> np.ndarray:
+        """Candidatos generales o de la banda de edad (en orden de relevancia), hasta age_fetch_k
+        
+        Si quedan menos de pad_k se completa con el resto: nunca se entregan menos chunks que sin
+        filtro. Con reranker k son todos sus candidatos y pad_k lo que llega al final, así los
+        chunks de otras bandas no ocupan candidatos que el filtro ya descartó.
+        """
+        from age_bands import AGE_BANDS
+        
+        masks = self.age_masks[ids]
+        matches = (masks == 0) | ((masks & (1 << AGE_BANDS.index(age_band))) != 0)
+        kept = ids[matches][:self.age_fetch_k]
+        pad_k = self.k if self.pad_k is None else self.pad_k
+        if len(kept) < pad_k:
+            kept = np.concatenate([kept, ids[~matches][:pad_k - len(kept)]])
+        return kept
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = 60) -> List[str]:
+    """Fusiona listas ordenadas de ids: score = sum(1 / (rrf_k + rango))"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+    # sorted es estable: a igual score gana el orden de la primera lista (la densa)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """Une el retriever MMR con búsqueda léxica BM25
+    
+    Los embeddings pueden no acercar términos clínicos exactos ("fontanela abultada",
+    "petequias"); BM25 los encuentra por coincidencia de palabras. Ambas listas se
+    fusionan por rango (RRF), sin necesidad de calibrar sus scores.
+    """
+    
+    dense: BaseRetriever
+    sparse: BM25Index
+    vectorstore: Any  # FAISS: para recuperar los chunks que solo encontró BM25
+    k: int = 6
+    sparse_k: int = 20
+    rrf_k: int = 60
+    
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                age_band: Optional[str] = None) -> List[Document]:
+        config = {"callbacks": run_manager.get_child()}
+        if age_band is None:
+            dense_docs = self.dense.invoke(query, config=config)
+        else:
+            dense_docs = self.dense.invoke(query, config=config, age_band=age_band)
+        return self._fuse(query, dense_docs, age_band)
+    
+    def batch_select(self, queries: List[str], query_vectors: np.ndarray,
+                     age_bands: List[Optional[str]]) -> List[List[Document]]:
+        dense_batches = self.dense.batch_select(queries, query_vectors, age_bands)
+        return [self._fuse(query, dense_docs, age_band)
+                for query, dense_docs, age_band in zip(queries, dense_batches, age_bands)]
+    
+    def _fuse(self, query: str, dense_docs: List[Document], age_band: Optional[str]) -> List[Document]:
+        sparse_ids = [doc_id for doc_id, _ in self.sparse.search(query, self.sparse_k)]
+        if age_band is not None:
+            sparse_ids = [doc_id for doc_id in sparse_ids if self._matches_age(doc_id, age_band)]
+        
+        by_id = {doc.id: doc for doc in dense_docs}
+        fused = reciprocal_rank_fusion([list(by_id), sparse_ids], self.rrf_k)[:self.k]
+        return [by_id.get(doc_id) or self.vectorstore.docstore.search(doc_id) for doc_id in fused]
+    
+    def _matches_age(self, doc_id: str, age_band: str) -> bool:
+        bands = self.vectorstore.docstore.search(doc_id).metadata.get("age_bands")
+        return not bands or age_band in bands
+
+
+class RerankingRetriever(BaseRetriever):
+    """Re-ordena los candidatos del retriever base con un cross-encoder
+    
+    El retriever base devuelve `candidates` chunks en orden MMR/RRF; con el reranker se
+    quedan los `k` mejor puntuados. Si el reranker no responde a tiempo se devuelven los
+    primeros `fallback_k` del orden original. No es exactamente el resultado sin reranker:
+    el RRF híbrido se calcula sobre `candidates` chunks densos, no sobre 6.
+    """
+    
+    base: BaseRetriever
+    reranker: Any  # CrossEncoderReranker
+    k: int = 4
+    fallback_k: int = 6
+    
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                **kwargs: Any) -> List[Document]:
+        candidates = self.base.invoke(query, config={"callbacks": run_manager.get_child()}, **kwargs)
+        return self._rerank(query, candidates)
+    
+    def batch_select(self, queries: List[str], query_vectors: np.ndarray,
+                     age_bands: List[Optional[str]]) -> List[List[Document]]:
+        return [self._rerank(query, candidates) for query, candidates in
+                zip(queries, self.base.batch_select(queries, query_vectors, age_bands))]
+    
+    def _rerank(self, query: str, candidates: List[Document]) -> List[Document]:
+        scores = self.reranker.score(query, [doc.page_content for doc in candidates])
+        if scores is None:
+            return candidates[:self.fallback_k]
+        order = np.argsort(-np.asarray(scores), kind="stable")[:self.k]
+        return [candidates[i] for i in order]
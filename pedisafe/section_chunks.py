@@ -0,0 +1,99 @@
+"""
+PediSafe Section Chunks
+Chunking jerárquico "small-to-big": secciones H2 de las guías como padres y
+fragmentos chicos (párrafos / subsecciones H3) como hijos que se vectorizan
+"""
+
+import re
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+# Un padre empieza en cada H2; H3/H4 quedan dentro de su sección (front matter + H1 forman el primero)
+_PARENT_RE = re.compile(r"^##\s+.+$", re.MULTILINE)
+_HEADING_RE = re.compile(r"^(#{1,4})\s+(.+)$", re.MULTILINE)
+
+CHILD_SEPARATORS = ["\n### ", "\n#### ", "\n\n", "\n", ". ", " "]
+
+
+def heading_stack(text: str, position: int) -> List[Tuple[int, str]]:
+    """(nivel, título) de los encabezados vigentes en `position`, del más general al más cercano"""
+    stack: List[Tuple[int, str]] = []
+    for match in _HEADING_RE.finditer(text):
+        if match.start() > position:
+            break
+        level = len(match.group(1))
+        stack = [(lvl, title) for lvl, title in stack if lvl < level] + [(level, match.group(2).strip())]
+    return stack
+
+
+def heading_path(text: str, position: int) -> str:
+    """Jerarquía de encabezados vigente en `position`: "Fever and Your Baby > Temperature Thresholds by Age" """
+    return " > ".join(title for _, title in heading_stack(text, position))
+
+
+def split_parents(text: str, parent_max: int) -> List[Tuple[int, str]]:
+    """(posición, texto) de cada sección H2; las que superan parent_max se parten sin solapamiento"""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    
+    starts = [0] + [match.start() for match in _PARENT_RE.finditer(text) if match.start() > 0]
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=parent_max, chunk_overlap=0, separators=CHILD_SEPARATORS, add_start_index=True
+    )
+    parents = []
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        section = text[start:end]
+        if not section.strip():
+            continue
+        if len(section) <= parent_max:
+            parents.append((start + len(section) - len(section.lstrip()), section.strip()))
+            continue
+        for piece in splitter.create_documents([section]):
+            parents.append((start + piece.metadata["start_index"], piece.page_content))
+    return parents
+
+
+def split_hierarchical(document: "Document", child_size: int, parent_max: int,
+                       source_id: Optional[str] = None) -> List["Document"]:
+    """Hijos de cada sección con metadatos del padre (parent_id, parent_content, section)
+    
+    `source_id` identifica el archivo en parent_id (ruta relativa a knowledge/); por
+    defecto la ruta completa de `source`, nunca solo el nombre: dos archivos homónimos
+    en distintas carpetas no son la misma sección.
+    
+    El texto vectorizado del hijo lleva delante la jerarquía de encabezados, así un
+    párrafo chico no pierde de qué sección (y de qué edad) habla.
+    """
+    from langchain_core.documents import Document
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    
+    text = document.page_content
+    source_id = source_id or document.metadata.get("source", "")
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=child_size, chunk_overlap=0, separators=CHILD_SEPARATORS, add_start_index=True
+    )
+    
+    children = []
+    for parent_number, (parent_start, parent_text) in enumerate(split_parents(text, parent_max)):
+        for piece in splitter.create_documents([parent_text]):
+            start = parent_start + piece.metadata["start_index"]
+            stack = heading_stack(text, start)
+            section = " > ".join(title for _, title in stack)
+            # Si el hijo empieza con su propio encabezado basta con sus ancestros (nivel menor),
+            # no con el encabezado del hermano anterior
+            own = _HEADING_RE.match(piece.page_content)
+            if own is not None:
+                stack = [(level, title) for level, title in stack if level < len(own.group(1))]
+            prefix = " > ".join(title for _, title in stack)
+            children.append(Document(
+                page_content=f"{prefix}\n{piece.page_content}" if prefix else piece.page_content,
+                metadata={
+                    **document.metadata,
+                    "start_index": start,
+                    "section": section,
+                    "parent_id": f"{source_id}#{parent_number}",
+                    "parent_content": parent_text,
+                },
+            ))
+    return children
@@ -0,0 +1,768 @@
+"""
+Offline tests for the PediSafe retrieval layer (Capa B)
+No API keys or network needed: embeddings are replaced by a deterministic fake
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+# Add pedisafe directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import knowledge_index
+import rag_engine
+from knowledge_index import KnowledgeIndex
+
+KNOWLEDGE_PATH = Path(__file__).parent / "knowledge"
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    """Fake embeddings that count how many texts were embedded"""
+    embedded_texts: int = 0
+    
+    def embed_documents(self, texts):
+        self.embedded_texts += len(texts)
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    """Replace provider embeddings with an offline fake"""
+    embeddings = CountingEmbedding(size=32)
+    
+    monkeypatch.setattr(KnowledgeIndex, "_create_embedder", lambda self: embeddings)
+    rag_engine.clear_shared_engines()
+    yield embeddings
+    rag_engine.clear_shared_engines()
+
+
+@pytest.fixture
+def knowledge_copy(tmp_path):
+    """Writable copy of the knowledge base"""
+    target = tmp_path / "knowledge"
+    target.mkdir()
+    for md_file in KNOWLEDGE_PATH.glob("*.md"):
+        (target / md_file.name).write_text(md_file.read_text(encoding="utf-8"), encoding="utf-8")
+    return target
+
+
+def index_dirs(cache_dir):
+    return [path for path in cache_dir.iterdir() if path.is_dir()]
+
+
+def make_index(knowledge_dir, cache_dir):
+    return KnowledgeIndex(str(knowledge_dir), "openai", "test-key", index_cache_dir=str(cache_dir))
+
+
+def test_index_cache_reused_when_unchanged(fake_embeddings, knowledge_copy, tmp_path):
+    cache_dir = tmp_path / "cache"
+    first = make_index(knowledge_copy, cache_dir)
+    built = fake_embeddings.embedded_texts
+    assert built > 0
+    assert len(index_dirs(cache_dir)) == 1
+    
+    second = make_index(knowledge_copy, cache_dir)
+    assert fake_embeddings.embedded_texts == built, "unchanged knowledge base must not be re-embedded"
+    assert second.vectorstore.index.ntotal == first.vectorstore.index.ntotal
+
+
+def test_index_cache_invalidated_on_chunking_change(fake_embeddings, knowledge_copy, tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    make_index(knowledge_copy, cache_dir)
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "chunk_size", 500)
+    make_index(knowledge_copy, cache_dir)
+    assert len(index_dirs(cache_dir)) == 2
+
+
+def test_embedding_cache_skips_known_text(fake_embeddings, knowledge_copy, tmp_path):
+    import shutil
+    
+    cache_dir = tmp_path / "cache"
+    first = make_index(knowledge_copy, cache_dir)
+    built = fake_embeddings.embedded_texts
+    
+    # Without the FAISS index every chunk is re-split, but no text is embedded again
+    for path in index_dirs(cache_dir):
+        shutil.rmtree(path)
+    second = make_index(knowledge_copy, cache_dir)
+    assert fake_embeddings.embedded_texts == built
+    assert second.embedding_cache.hits == built
+    query = fake_embeddings.embed_query("fiebre")
+    assert [doc.page_content for doc in second.vectorstore.similarity_search_by_vector(query, k=3)] == \
+        [doc.page_content for doc in first.vectorstore.similarity_search_by_vector(query, k=3)]
+
+
+def test_incremental_reindex_only_embeds_changed_files(fake_embeddings, knowledge_copy, tmp_path):
+    cache_dir = tmp_path / "cache"
+    make_index(knowledge_copy, cache_dir)
+    built = fake_embeddings.embedded_texts
+    
+    (knowledge_copy / "extra.md").write_text("## New guideline\n\nFever in toddlers.", encoding="utf-8")
+    index = make_index(knowledge_copy, cache_dir)
+    assert fake_embeddings.embedded_texts == built + 1
+    assert index.vectorstore.index.ntotal == built + 1
+    
+    # Edited file: its old vectors are replaced, nothing else is re-embedded
+    (knowledge_copy / "extra.md").write_text("## New guideline\n\nFever in teenagers.", encoding="utf-8")
+    index = make_index(knowledge_copy, cache_dir)
+    assert fake_embeddings.embedded_texts == built + 2
+    assert index.vectorstore.index.ntotal == built + 1
+    contents = [doc.page_content for doc in index.vectorstore.docstore._dict.values()]
+    assert any("teenagers" in text for text in contents)
+    assert not any("toddlers" in text for text in contents)
+    
+    # Removed file: stale vectors leave both the FAISS index and the docstore
+    (knowledge_copy / "extra.md").unlink()
+    index = make_index(knowledge_copy, cache_dir)
+    assert fake_embeddings.embedded_texts == built + 2
+    assert index.vectorstore.index.ntotal == built
+    assert len(index.vectorstore.docstore._dict) == built
+    assert len(index.vectorstore.index_to_docstore_id) == built
+
+
+def test_identical_files_get_distinct_chunks_and_sections(fake_embeddings, knowledge_copy, tmp_path):
+    guideline = "## Shared guideline\n\nFever in toddlers is usually mild."
+    for folder in ("aap", "nhs"):
+        (knowledge_copy / folder).mkdir()
+        (knowledge_copy / folder / "fever.md").write_text(guideline, encoding="utf-8")
+    cache_dir = tmp_path / "cache"
+    index = make_index(knowledge_copy, cache_dir)  # Construcción completa
+    
+    (knowledge_copy / "copy.md").write_text(guideline, encoding="utf-8")
+    index = make_index(knowledge_copy, cache_dir)  # Alta incremental del mismo contenido
+    
+    copies = [doc for doc in index.vectorstore.docstore._dict.values() if "toddlers is usually" in doc.page_content]
+    assert len(copies) == 3
+    assert len({doc.id for doc in copies}) == 3
+    # Homónimos en distintas carpetas no se funden al deduplicar secciones
+    assert {doc.metadata["parent_id"] for doc in copies} == {"aap/fever.md#0", "nhs/fever.md#0", "copy.md#0"}
+
+
+def test_refresh_publishes_new_index(fake_embeddings, knowledge_copy, tmp_path):
+    index = make_index(knowledge_copy, tmp_path / "cache")
+    previous = index.vectorstore
+    old_state = index._state
+    (knowledge_copy / "extra.md").write_text("## New guideline\n\nFever in toddlers.", encoding="utf-8")
+    index.refresh()
+    assert index.vectorstore is not previous
+    assert index.vectorstore.index.ntotal == previous.index.ntotal + 1
+    # Versión nueva publicada entera; quien aún tenga la anterior la ve sin mezclar
+    assert index._state is not old_state
+    assert old_state.vectorstore is previous and old_state.retriever.vectorstore is previous
+    assert index.retriever.vectorstore is index.vectorstore
+    assert index.sparse_index is not old_state.sparse_index
+    # Secciones padre: se conservan las de archivos sin cambios y se agregan las nuevas
+    assert index.parents == {**old_state.parents, "extra.md#0": "## New guideline\n\nFever in toddlers."}
+    (knowledge_copy / "extra.md").unlink()
+    index.refresh()
+    assert index.parents == old_state.parents
+
+
+def test_shared_engine_built_once_across_threads(fake_embeddings, knowledge_copy, tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "index_cache_dir", str(tmp_path / "cache"))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        engines = list(pool.map(
+            lambda _: rag_engine.get_shared_engine("test-key", str(knowledge_copy), "en", "openai"),
+            range(16)
+        ))
+    assert len({id(engine) for engine in engines}) == 1
+    assert len(rag_engine._ENGINES) == 1
+
+
+def test_shared_registries_evict_least_recently_used_key(fake_embeddings, knowledge_copy, tmp_path, monkeypatch):
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "index_cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(knowledge_index._INDEXES, "max_items", 2)
+    monkeypatch.setattr(rag_engine._ENGINES, "max_items", 4)
+    
+    first = knowledge_index.get_shared_index(str(knowledge_copy), "openai", "key-1")
+    knowledge_index.get_shared_index(str(knowledge_copy), "openai", "key-2")
+    assert knowledge_index.get_shared_index(str(knowledge_copy), "openai", "key-1") is first  # Uso reciente
+    for n in range(3, 8):
+        rag_engine.get_shared_engine(f"key-{n}", str(knowledge_copy), "en", "openai")
+    
+    # Memoria acotada aunque lleguen muchas API keys distintas
+    assert len(knowledge_index._INDEXES) == 2 and len(rag_engine._ENGINES) == 4
+    assert knowledge_index._INDEXES._build_locks == {}
+    assert knowledge_index._index_key(str(knowledge_copy), "openai", "key-1", None) not in knowledge_index._INDEXES
+
+
+def test_shared_registry_releases_build_lock_when_factory_fails():
+    registry = knowledge_index.SharedRegistry(max_items=2)
+    
+    def broken():
+        raise RuntimeError("sin índice")
+    
+    with pytest.raises(RuntimeError):
+        registry.get_or_create(("key",), broken)
+    assert registry._build_locks == {} and ("key",) not in registry
+    assert registry.get_or_create(("key",), lambda: "index") == "index"
+    assert registry._build_locks == {}
+
+
+def test_language_switch_reuses_shared_index(fake_embeddings, knowledge_copy, tmp_path, monkeypatch):
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "index_cache_dir", str(tmp_path / "cache"))
+    english = rag_engine.get_shared_engine("test-key", str(knowledge_copy), "en", "openai")
+    built = fake_embeddings.embedded_texts
+    
+    spanish = rag_engine.get_shared_engine("test-key", str(knowledge_copy), "es", "openai")
+    assert spanish is not english
+    assert spanish.index is english.index
+    assert spanish.prompt is not english.prompt
+    assert fake_embeddings.embedded_texts == built
+    assert rag_engine.get_shared_engine("test-key", str(knowledge_copy), "en", "openai") is english
+
+
+@pytest.mark.parametrize("mode", ["serial", "batched", "parallel"])
+def test_batched_embeddings_preserve_order(mode):
+    from batch_embeddings import BatchedEmbeddings
+    
+    base = CountingEmbedding(size=16)
+    texts = [f"chunk {i}" for i in range(50)]
+    batched = BatchedEmbeddings(base, mode=mode, batch_size=8, workers=4)
+    assert batched.embed_documents(texts) == base.embed_documents(texts)
+    assert batched.last_stats["chunks"] == 50
+    assert batched.last_stats["chunks_per_sec"] > 0
+
+
+def test_import_does_not_load_heavy_backends():
+    import subprocess
+    
+    code = (
+        "import sys; import rag_engine; "
+        "print([m for m in ('langchain_openai', 'langchain_community', 'faiss', 'torch') if m in sys.modules])"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=str(Path(__file__).parent))
+    assert out.stdout.strip() == "[]"
+
+
+def test_background_warmup_shares_index(fake_embeddings, knowledge_copy, tmp_path, monkeypatch):
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "index_cache_dir", str(tmp_path / "cache"))
+    thread = knowledge_index.warm_up_shared_index(str(knowledge_copy), "openai", "test-key")
+    assert thread is not None
+    engine = rag_engine.get_shared_engine("test-key", str(knowledge_copy), "en", "openai")
+    thread.join(timeout=30)
+    assert engine.index is knowledge_index.get_shared_index(str(knowledge_copy), "openai", "test-key")
+    assert knowledge_index.warm_up_shared_index(str(knowledge_copy), "openai", "test-key") is None
+
+
+def test_mmap_snapshot_matches_in_memory_index(fake_embeddings, knowledge_copy, tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "mmap_index", False)
+    in_memory = make_index(knowledge_copy, cache_dir)
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "mmap_index", True)
+    mapped = make_index(knowledge_copy, cache_dir)
+    
+    query = fake_embeddings.embed_query("bebé de 2 meses con fiebre")
+    expected = in_memory.vectorstore.similarity_search_with_score_by_vector(query, k=5)
+    got = mapped.vectorstore.similarity_search_with_score_by_vector(query, k=5)
+    assert [doc.page_content for doc, _ in got] == [doc.page_content for doc, _ in expected]
+    assert mapped.vectorstore.index.ntotal == in_memory.vectorstore.index.ntotal
+
+
+def test_mmap_warns_once_when_faiss_cannot_map_flat_codes(fake_embeddings, knowledge_copy, tmp_path,
+                                                        monkeypatch, capsys):
+    import ann_index
+    
+    make_index(knowledge_copy, tmp_path / "cache")
+    monkeypatch.setattr(ann_index, "IO_FLAG_MMAP_IFC", None)
+    monkeypatch.setattr(ann_index, "_warned_no_mmap_ifc", False)
+    capsys.readouterr()
+    
+    for _ in range(2):
+        assert make_index(knowledge_copy, tmp_path / "cache").vectorstore.index.ntotal > 0
+    assert capsys.readouterr().out.count("no soporta mmap de índices planos") == 1
+
+
+@pytest.mark.parametrize("index_type", ["ivf", "hnsw"])
+def test_ann_index_types_recall_against_flat(index_type):
+    import faiss
+    import numpy as np
+    from ann_index import build_ann_index
+    
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 32))
+    vectors = (centers[rng.integers(0, 20, 2000)] + 0.1 * rng.normal(size=(2000, 32))).astype("float32")
+    flat = faiss.IndexFlatL2(32)
+    flat.add(vectors)
+    
+    index = build_ann_index(vectors, index_type, {"nprobe": 8})
+    assert index is not None and index.ntotal == 2000
+    _, expected = flat.search(vectors[:50], 6)
+    _, got = index.search(vectors[:50], 6)
+    recall = np.mean([len(set(e) & set(g)) / 6 for e, g in zip(expected, got)])
+    assert recall > 0.5
+    index.reconstruct(0)  # Needed by LangChain MMR
+
+
+@pytest.mark.parametrize("index_type", ["pq", "ivfpq"])
+def test_pq_index_types_train_and_search(index_type):
+    import numpy as np
+    from ann_index import build_ann_index
+    
+    vectors = np.random.default_rng(0).normal(size=(400, 32)).astype("float32")
+    index = build_ann_index(vectors, index_type, {"nlist": 4, "nprobe": 4})
+    assert index is not None and index.ntotal == 400
+    _, got = index.search(vectors[:5], 6)
+    assert (got >= 0).all()
+    index.reconstruct(0)
+
+
+def test_ann_index_falls_back_to_flat_on_tiny_corpus():
+    import numpy as np
+    from ann_index import build_ann_index
+    
+    assert build_ann_index(np.ones((10, 32), dtype="float32"), "ivf", {}) is None
+
+
+def test_hnsw_serving_index_is_cached_with_snapshot(fake_embeddings, knowledge_copy, tmp_path, monkeypatch):
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "index_type", "hnsw")
+    cache_dir = tmp_path / "cache"
+    first = make_index(knowledge_copy, cache_dir)
+    second = make_index(knowledge_copy, cache_dir)
+    assert type(second.vectorstore.index).__name__ == "IndexHNSWFlat"
+    assert list(cache_dir.glob("*/*/index.hnsw-*.faiss"))
+    assert len(second.retriever.invoke("fiebre en bebé")) == 6
+    assert second.vectorstore.index.ntotal == first.vectorstore.index.ntotal
+
+
+@pytest.mark.parametrize("storage", ["float16", "int8"])
+def test_compact_storage_keeps_mmr_top_chunks(fake_embeddings, knowledge_copy, tmp_path, monkeypatch, storage):
+    cache_dir = tmp_path / "cache"
+    exact = make_index(knowledge_copy, cache_dir)
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "vector_storage", storage)
+    compact = make_index(knowledge_copy, cache_dir)
+    assert type(compact.vectorstore.index).__name__ == "IndexRefine"
+    assert list(cache_dir.glob(f"*/*/index.flat-{storage}-*.faiss"))
+    
+    for query in ("bebé de 2 meses con fiebre", "when to call the pediatrician", "stiff neck"):
+        expected = [doc.page_content for doc in exact.retriever.invoke(query)]
+        assert [doc.page_content for doc in compact.retriever.invoke(query)] == expected
+
+
+def test_query_embedding_lru_skips_repeated_queries(fake_embeddings, knowledge_copy, tmp_path):
+    index = make_index(knowledge_copy, tmp_path / "cache")
+    calls = []
+    original = fake_embeddings.embed_query
+    object.__setattr__(fake_embeddings, "embed_query", lambda text: calls.append(text) or original(text))
+    
+    first = [doc.page_content for doc in index.retriever.invoke("My 2 month old has 38.2")]
+    second = [doc.page_content for doc in index.retriever.invoke("  my 2 month  OLD has 38.2 ")]
+    assert first == second
+    assert calls == ["my 2 month old has 38.2"]
+    assert index.query_cache.stats()["hits"] == 1
+    assert index.query_cache.stats()["misses"] == 1
+
+
+def test_query_embedding_lru_is_bounded():
+    from embedding_cache import LRUQueryEmbeddings
+    
+    lru = LRUQueryEmbeddings(CountingEmbedding(size=8), "fake", max_size=2)
+    for text in ("a", "b", "a", "c", "b"):
+        lru.embed_query(text)
+    assert lru.stats() == {"hits": 1, "misses": 4, "size": 2, "hit_rate": 0.2}
+
+
+class FakeLLM:
+    """Counts generations instead of calling a provider"""
+    
+    def __init__(self):
+        self.calls = 0
+    
+    def invoke(self, messages):
+        self.calls += 1
+        return type("Message", (), {"content": f"answer {self.calls}"})()
+
+
+def make_engine(knowledge_dir, cache_dir, language="en"):
+    engine = rag_engine.PediSafeRAG("test-key", str(knowledge_dir), language, "openai",
+                                    index=make_index(knowledge_dir, cache_dir))
+    engine.llm = FakeLLM()
+    return engine
+
+
+def test_response_cache_reuses_answer_for_same_question(fake_embeddings, knowledge_copy, tmp_path):
+    engine = make_engine(knowledge_copy, tmp_path / "cache")
+    
+    first = engine.get_response("My 8 month old has 38.5 C and is eating well")
+    second = engine.get_response("my 8 month old  has 38.5 C and is eating WELL")
+    assert first == second == "answer 1"
+    assert engine.llm.calls == 1
+    assert rag_engine._RESPONSES.stats()["hits"] == 1
+
+
+def test_response_cache_key_separates_triage_inputs(fake_embeddings, knowledge_copy, tmp_path):
+    engine = make_engine(knowledge_copy, tmp_path / "cache")
+    spanish = make_engine(knowledge_copy, tmp_path / "cache", language="es")
+    spanish.llm = engine.llm
+    
+    engine.get_response("My 8 month old has 38.5 C")
+    engine.get_response("My 8 month old has 38.5 C", chat_history="User: he also vomited")
+    spanish.get_response("My 8 month old has 38.5 C")
+    assert engine.llm.calls == 3
+    assert engine._response_cache_key("My 8 month old has 38.5 C", "", False, "") != \
+        engine._response_cache_key("My 2 month old has 38.5 C", "", True, "bebé <3 meses con fiebre 38.5°C")
+
+
+def test_response_cache_misses_after_index_refresh_or_rules_reload(fake_embeddings, knowledge_copy, tmp_path,
+                                                                  monkeypatch):
+    import copy
+    import triage
+    
+    engine = make_engine(knowledge_copy, tmp_path / "cache")
+    question = "My 8 month old has 38.5 C and is eating well"
+    version = engine.index.version
+    assert engine.get_response(question) == engine.get_response(question) == "answer 1"
+    
+    # knowledge/ cambió: las respuestas generadas con el índice anterior no se sirven
+    (knowledge_copy / "extra.md").write_text("## New guideline\n\nFever in toddlers.", encoding="utf-8")
+    engine.index.refresh()
+    assert engine.index.version != version
+    assert engine.get_response(question) == "answer 2"
+    engine.index.refresh()  # Sin cambios: misma versión, la caché sigue sirviendo
+    assert engine.get_response(question) == "answer 2"
+    
+    # triage_rules.json recargado con otra versión
+    edited = copy.copy(triage.current_rules())
+    edited.version = "edited"
+    monkeypatch.setattr(rag_engine, "current_rules", lambda: edited)
+    assert engine.get_response(question) == "answer 3"
+    assert engine.llm.calls == 3
+
+
+def test_response_cache_ttl_and_eviction(monkeypatch):
+    from response_cache import ResponseCache
+    import response_cache
+    
+    now = [100.0]
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: now[0])
+    cache = ResponseCache(threshold=0.9, ttl_seconds=10, max_entries=2)
+    cache.put(("en",), "a", [1.0, 0.0], "A")
+    cache.put(("en",), "b", [0.0, 1.0], "B")
+    assert cache.get(("en",), [0.99, 0.05]) == "A"
+    assert cache.get(("es",), [1.0, 0.0]) is None
+    assert cache.get(("en",), [0.7, 0.7]) is None
+    
+    cache.put(("en",), "c", [-1.0, 0.0], "C")  # Desaloja "b" (la menos usada)
+    assert cache.get(("en",), [0.0, 1.0]) is None
+    assert len(cache) == 2
+    
+    now[0] += 11
+    assert cache.get(("en",), [1.0, 0.0]) is None
+    assert len(cache) == 0
+
+
+def test_bm25_ranks_exact_terms_and_ignores_accents():
+    from bm25_index import BM25Index
+    
+    sparse = BM25Index.from_texts(
+        ["a", "b", "c"],
+        ["Fever in babies under 3 months", "Call if there is a bulging soft spot", "Convulsión febril"],
+    )
+    assert [doc_id for doc_id, _ in sparse.search("bulging fontanelle")] == ["b"]
+    assert [doc_id for doc_id, _ in sparse.search("convulsion")] == ["c"]
+    assert sparse.search("nothing matches") == []
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    from retrievers import reciprocal_rank_fusion
+    
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]]) == ["c", "a", "b", "d"]
+
+
+def test_hybrid_retriever_surfaces_lexical_match(fake_embeddings, knowledge_copy, tmp_path):
+    index = make_index(knowledge_copy, tmp_path / "cache")
+    docs = index.retriever.invoke("bulging soft spot")
+    assert len(docs) == 6
+    assert any("Bulging soft spot" in doc.page_content for doc in docs)
+    
+    # El índice BM25 se guarda junto al snapshot y se reutiliza
+    assert list((tmp_path / "cache").glob("*/*/bm25-*.pkl"))
+    assert len(make_index(knowledge_copy, tmp_path / "cache").sparse_index) == len(index.sparse_index)
+
+
+@pytest.mark.parametrize("use_gram", [True, False])
+def test_vectorized_mmr_matches_langchain_mmr(fake_embeddings, knowledge_copy, tmp_path, monkeypatch, use_gram):
+    import numpy as np
+    
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "mmr_gram_limit", 10_000 if use_gram else 0)
+    index = make_index(knowledge_copy, tmp_path / "cache")
+    dense = index.retriever.dense
+    assert (dense.gram is not None) == use_gram
+    
+    reference = index.vectorstore.as_retriever(
+        search_type="mmr", search_kwargs={"k": 6, "fetch_k": 20, "lambda_mult": 0.7}
+    )
+    for query in ("My 2 month old has a fever", "bulging soft spot", "when to call the doctor"):
+        assert [doc.id for doc in dense.invoke(query)] == [doc.id for doc in reference.invoke(query)]
+    
+    # Las matrices se guardan con el snapshot y se reutilizan
+    assert list((tmp_path / "cache").glob("*/*/mmr_vectors-float32.npy"))
+    reloaded = make_index(knowledge_copy, tmp_path / "cache").retriever.dense
+    assert np.array_equal(np.asarray(reloaded.vectors), np.asarray(dense.vectors))
+    # Se sirven con mmap, sin una segunda copia de los vectores en memoria
+    assert isinstance(reloaded.vectors, np.memmap)
+    # Un gram guardado con un límite mayor no se carga si el límite baja
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "mmr_gram_limit", 0)
+    assert make_index(knowledge_copy, tmp_path / "cache").retriever.dense.gram is None
+
+
+@pytest.mark.parametrize("language, level, flag", [
+    ("en", "RED", "baby under 3 months with fever 38.2°C"),
+    ("es", "ROJO", "bebé <3 meses con fiebre 38.2°C"),
+])
+def test_emergency_fast_path_skips_retrieval_and_llm(fake_embeddings, knowledge_copy, tmp_path,
+                                                      monkeypatch, language, level, flag):
+    import time
+    
+    engine = make_engine(knowledge_copy, tmp_path / "cache", language=language)
+    # Cualquier retrieval fallaría
+    monkeypatch.setattr(engine.index, "_state", engine.index._state._replace(retriever=None))
+    
+    start = time.perf_counter()
+    response = engine.get_response("My 2 month old has 38.2 C")
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    
+    assert elapsed_ms < 50
+    assert engine.llm.calls == 0
+    assert response.startswith(f"🔴 **{level}")
+    assert flag in response
+    assert "https://www.healthychildren.org/English/health-issues/conditions/fever/Pages/" in response
+    assert "https://www.nhs.uk/conditions/fever-in-children/" in response
+    assert engine.get_emergency_response("seizure") is not None
+    assert engine.get_emergency_response("My 8 month old has 38.5 C") is None
+
+
+def test_critical_cases_offline_fast_path_matches_expected_level(fake_embeddings, knowledge_copy, tmp_path):
+    from test_pedisafe import CRITICAL_TEST_CASES, EDGE_CASE_TESTS, FALSE_POSITIVE_TESTS
+    
+    engine = make_engine(knowledge_copy, tmp_path / "cache")
+    for case in CRITICAL_TEST_CASES + EDGE_CASE_TESTS + FALSE_POSITIVE_TESTS:
+        calls = engine.llm.calls
+        fast_path = engine.get_response(case.input).startswith("🔴")
+        # Sin LLM que corrija, la tarjeta ROJO nunca puede salir para un caso que no es ROJO
+        assert not fast_path or case.expected_level == "RED", case.description
+        # Los ROJO críticos (fiebre <3 meses, dificultad respiratoria, convulsión) son deterministas
+        if case in CRITICAL_TEST_CASES and case.expected_level == "RED":
+            assert fast_path, case.description
+        assert engine.llm.calls == calls + (0 if fast_path else 1)
+    
+    fever = engine.get_response("10 semanas, 38.5°C, sin otros síntomas")
+    assert "baby under 3 months with fever 38.5°C" in fever
+    assert engine.get_response("4 meses, 39.2°C rectal, 8 horas").startswith("answer")
+
+
+def test_emergency_elaboration_runs_full_rag_in_background(fake_embeddings, knowledge_copy, tmp_path):
+    engine = make_engine(knowledge_copy, tmp_path / "cache")
+    
+    assert engine.elaborate_emergency("My baby had a seizure").result(timeout=10) == "answer 1"
+    assert engine.llm.calls == 1
+
+
+def test_format_docs_uses_precomputed_blocks_and_caches_context(fake_embeddings, knowledge_copy, tmp_path,
+                                                                monkeypatch):
+    from langchain_core.documents import Document
+    
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "chunking",
+                        dict(knowledge_index.RAG_CONFIG["chunking"], mode="recursive"))
+    engine = make_engine(knowledge_copy, tmp_path / "cache")
+    docs = engine.retriever.invoke("fever in a 2 month old baby")
+    assert all("citation" in doc.metadata and "context_block" not in doc.metadata for doc in docs)
+    assert engine.index.parents == {}  # Sin secciones padre: el bloque es el propio chunk
+    
+    context = engine._format_docs(docs)
+    assert context.startswith(f"[Fragment 1] Source: {docs[0].metadata['citation']}\n{docs[0].page_content}")
+    assert context.count("\n\n---\n\n") == len(docs) - 1
+    assert engine._format_docs(docs) is context  # Misma selección: contexto cacheado
+    
+    # Chunks sin metadatos precalculados se formatean igual que antes
+    legacy = Document(page_content="Call 911", metadata={"source": "knowledge/nhs_fever_children.md"})
+    assert engine._format_docs([legacy]) == (
+        "[Fragment 1] Source: [High Temperature in Children - NHS]"
+        "(https://www.nhs.uk/conditions/fever-in-children/)\nCall 911"
+    )
+
+
+def test_age_band_tagging():
+    from age_bands import age_band_for, tag_age_bands
+    
+    assert tag_age_bands("### Infants 0-3 months\nAny fever is an emergency") == ["0-3_months"]
+    assert tag_age_bands("Children over 12 months") == ["over_12_months"]
+    assert tag_age_bands("Bebés menores de 3 meses") == ["0-3_months"]
+    assert tag_age_bands("Under 4 weeks") == ["0-3_months"]
+    assert tag_age_bands("Fever helps fight infection") == []
+    assert [age_band_for(age) for age in (0, 2, 3, 8, 36, None)] == \
+        ["0-3_months", "0-3_months", "3-6_months", "6-12_months", "over_12_months", None]
+
+
+def test_retrieval_filters_by_age_band(fake_embeddings, knowledge_copy, tmp_path):
+    index = make_index(knowledge_copy, tmp_path / "cache")
+    chunks = index.vectorstore.docstore._dict.values()
+    assert any(doc.metadata["age_bands"] == ["over_12_months"] for doc in chunks)
+    
+    for query in ("My baby has a fever", "when to call the doctor", "bulging soft spot"):
+        docs = index.retrieve(query, age_months=1)
+        assert len(docs) == 6
+        assert all(not doc.metadata["age_bands"] or "0-3_months" in doc.metadata["age_bands"] for doc in docs)
+    assert index.retrieve("My baby has a fever") == index.retriever.invoke("My baby has a fever")
+
+
+def test_age_filter_keeps_emergency_chunks_for_older_children(fake_embeddings, knowledge_copy, tmp_path):
+    index = make_index(knowledge_copy, tmp_path / "cache")
+    chunks = index.vectorstore.docstore._dict.values()
+    # Menciona "under 3 months" en el cuerpo, pero es una sección de emergencia: aplica a toda edad
+    emergency = next(doc for doc in chunks if "Call 999 or go to A&E" in doc.metadata["section"]
+                     and "under 3 months" in doc.page_content)
+    assert emergency.metadata["age_bands"] == []
+    rectal = next(doc for doc in chunks if "### Rectal" in doc.page_content)
+    assert rectal.metadata["age_bands"] == []
+    
+    query = "finding it hard to breathe, not responding, under 3 months old with a temperature"
+    for age_months in (None, 1, 24, 60):
+        assert emergency.id in [doc.id for doc in index.retrieve(query, age_months)]
+
+
+class FakeCrossEncoder:
+    """Scores chunks by how many times they mention 'fever'; optionally slow"""
+    
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+    
+    def predict(self, pairs):
+        import time
+        
+        self.batches.append(len(pairs))
+        time.sleep(self.delay)
+        return [text.lower().count("fever") for _, text in pairs]
+
+
+@pytest.mark.parametrize("delay, reranked", [(0.0, True), (0.5, False)])
+def test_reranker_scores_one_batch_within_budget(fake_embeddings, knowledge_copy, tmp_path, monkeypatch,
+                                                 delay, reranked):
+    from reranker import CrossEncoderReranker
+    
+    model = FakeCrossEncoder(delay)
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "reranker", dict(
+        knowledge_index.RAG_CONFIG["reranker"], enabled=True, budget_ms=100
+    ))
+    monkeypatch.setattr(knowledge_index, "get_shared_reranker",
+                        lambda name, budget_ms: CrossEncoderReranker(name, budget_ms, model=model))
+    index = make_index(knowledge_copy, tmp_path / "cache")
+    candidates = index.retriever.base.invoke("baby fever")
+    
+    docs = index.retriever.invoke("baby fever")
+    assert model.batches[-1] == len(candidates) == 20
+    if reranked:
+        counts = [doc.page_content.lower().count("fever") for doc in docs]
+        assert len(docs) == 4
+        assert counts == sorted((c.page_content.lower().count("fever") for c in candidates), reverse=True)[:4]
+    else:
+        assert [doc.id for doc in docs] == [doc.id for doc in candidates[:6]]
+        assert index.retriever.reranker.timeouts == 1
+        # Mientras el lote vencido sigue corriendo no se encola otro
+        assert len(index.retriever.invoke("baby fever")) == 6
+        assert len(model.batches) == 1 and index.retriever.reranker.skipped == 1
+
+
+def test_age_filter_pads_only_up_to_reranker_output(fake_embeddings, knowledge_copy, tmp_path, monkeypatch):
+    from reranker import CrossEncoderReranker
+    
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "reranker",
+                        dict(knowledge_index.RAG_CONFIG["reranker"], enabled=True))
+    monkeypatch.setattr(knowledge_index, "get_shared_reranker",
+                        lambda name, budget_ms: CrossEncoderReranker(name, budget_ms, model=FakeCrossEncoder()))
+    dense = make_index(knowledge_copy, tmp_path / "cache").retriever.base.dense
+    
+    for query in ("My baby has a fever", "when to call the doctor", "bulging soft spot"):
+        docs = dense.invoke(query, age_band="0-3_months")
+        in_band = [not doc.metadata["age_bands"] or "0-3_months" in doc.metadata["age_bands"] for doc in docs]
+        # Chunks de otras bandas solo para llegar a los 6 del fallback, no a los 20 candidatos
+        assert len(docs) >= 6 and len(docs) - sum(in_band) == max(0, 6 - sum(in_band))
+
+
+@pytest.mark.parametrize("hybrid", [True, False])
+def test_retrieve_batch_matches_single_queries(fake_embeddings, knowledge_copy, tmp_path, monkeypatch, hybrid):
+    monkeypatch.setitem(knowledge_index.RAG_CONFIG, "hybrid_search",
+                        dict(knowledge_index.RAG_CONFIG["hybrid_search"], enabled=hybrid))
+    engine = make_engine(knowledge_copy, tmp_path / "cache")
+    messages = ["My 2 month old has 38.2", "bulging soft spot", "Mi hijo de 3 años tiene 39 grados",
+                "when to call the doctor", "My 2 month old has 38.2"]
+    
+    calls = []
+    original = engine.index.vectorstore.index.search
+    monkeypatch.setattr(engine.index.vectorstore.index, "search",
+                        lambda x, k, *args, **kwargs: calls.append(len(x)) or original(x, k, *args, **kwargs))
+    batch = engine.retrieve_batch(messages)
+    assert calls == [len(messages)]
+    
+    expected = [engine.index.retrieve(message, engine._extract_age_temp(message)["age_months"])
+                for message in messages]
+    assert [[doc.id for doc in docs] for docs in batch] == [[doc.id for doc in docs] for docs in expected]
+    assert engine.retrieve_batch([]) == []
+
+
+def test_retrieve_batch_does_not_persist_queries(fake_embeddings, knowledge_copy, tmp_path):
+    index = make_index(knowledge_copy, tmp_path / "cache")
+    rows = "SELECT COUNT(*) FROM embeddings"
+    stored = index.embedding_cache._connection().execute(rows).fetchone()[0]
+    embedded = fake_embeddings.embedded_texts
+    
+    index.retrieve_batch(["My 2 month old has 38.2", "stiff neck", "  my 2 month OLD has 38.2"])
+    assert index.embedding_cache._connection().execute(rows).fetchone()[0] == stored
+    # Un solo lote con las consultas distintas; la repetida sale de la caché LRU
+    assert fake_embeddings.embedded_texts == embedded + 2
+    index.retrieve_batch(["stiff neck"])
+    assert fake_embeddings.embedded_texts == embedded + 2
+    assert index.query_cache.stats()["hits"] == 2
+
+
+def test_hierarchical_child_prefix_uses_only_its_own_ancestors():
+    from langchain_core.documents import Document
+    from section_chunks import split_hierarchical
+    
+    text = ("# Guide\n\n## Thresholds\n\n### Infants 0-3 months\nAny fever is an emergency.\n\n"
+            "### Infants 3-6 months\nCall the pediatrician.\n\n#### Over 12 months note\nDetail.\n\n"
+            "## How to Take Temperature\n\n### Rectal\nMost accurate for infants.\n")
+    children = split_hierarchical(Document(page_content=text, metadata={"source": "guide.md"}), 60, 2000)
+    prefixes = {}
+    for doc in children[1:]:
+        prefix, body = doc.page_content.split("\n", 1)
+        prefixes[body.split("\n", 1)[0]] = prefix
+    
+    # H3 tras un H3 hermano: el prefijo no arrastra al hermano
+    assert prefixes["### Infants 3-6 months"] == "Guide > Thresholds"
+    # H2 tras un H4 más profundo: solo el H1
+    assert prefixes["## How to Take Temperature"] == "Guide"
+    assert prefixes["### Rectal"] == "Guide > How to Take Temperature"
+
+
+def test_hierarchical_chunks_expand_to_deduplicated_sections(fake_embeddings, knowledge_copy, tmp_path):
+    engine = make_engine(knowledge_copy, tmp_path / "cache")
+    source = (knowledge_copy / "aap_fever_baby.md").read_text(encoding="utf-8")
+    children = [doc for doc in engine.index.vectorstore.docstore._dict.values()
+                if doc.metadata["source"].endswith("aap_fever_baby.md")]
+    
+    infants = next(doc for doc in children if "### Infants 0-3 months" in doc.page_content)
+    assert infants.page_content.startswith("Fever and Your Baby\n## Temperature Thresholds by Age")
+    assert infants.metadata["section"] == "Fever and Your Baby > Temperature Thresholds by Age"
+    assert infants.metadata["age_bands"] == ["0-3_months"]
+    # El texto del padre se guarda una vez por sección en el índice, no en cada hijo
+    assert "parent_content" not in infants.metadata and "context_block" not in infants.metadata
+    parent = engine.index.parents[infants.metadata["parent_id"]]
+    assert parent in source and "### Infants 3-6 months" in parent  # Sección completa (padre)
+    assert set(engine.index.parents) == {doc.metadata["parent_id"]
+                                         for doc in engine.index.vectorstore.docstore._dict.values()}
+    assert source[infants.metadata["start_index"]:].startswith(infants.page_content.split("\n", 1)[1])
+    assert all(len(doc.page_content) <= 400 + len(doc.metadata["section"]) + 1 for doc in children)
+    
+    siblings = [doc for doc in children if doc.metadata["parent_id"] == infants.metadata["parent_id"]]
+    assert len(siblings) > 1
+    context = engine._format_docs(siblings + [infants])
+    assert context == f"[Fragment 1] Source: {infants.metadata['citation']}\n{parent}"
+    assert context.count("### Infants 0-3 months") == 1
@@ -0,0 +1,213 @@
+"""
+Offline tests for the PediSafe deterministic triage rules (Capa A)
+No API keys, models or network needed
+"""
+
+import copy
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add pedisafe directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import triage
+from config import TRIAGE_RULES
+from triage import (FlagMatch, Mention, RedFlagMatcher, RuleSet, RulesWatcher, check_emergency, check_red_flags,
+                    classify_batch, extract_age_temp, normalize_text, scan_mentions)
+
+
+def test_red_flag_matcher_reports_every_match_with_spans():
+    matcher = RedFlagMatcher(["no respira", "no responde", "seizure", "dificultad respiratoria"])
+    message = "Tuvo un SEIZURE, no responde y tiene dificultad respiratoria"
+    
+    matches = matcher.find_all(message)
+    
+    assert [match.flag for match in matches] == ["seizure", "no responde", "dificultad respiratoria"]
+    assert all(normalize_text(message)[match.start:match.end] == match.flag for match in matches)
+    assert matcher.find_all("fiebre de 38 y tos") == []
+
+
+def test_red_flag_matcher_prefers_longest_rule_and_list_priority():
+    matcher = RedFlagMatcher(["stiff neck", "manchas", "manchas púrpura"])
+    
+    assert matcher.find_all("tiene manchas púrpura") == [FlagMatch("manchas púrpura", 6, 21)]
+    # Varias señales: gana la primera de la lista de reglas, como el bucle anterior
+    assert matcher.first("manchas y stiff neck").flag == "stiff neck"
+
+
+def test_scan_mentions_returns_every_age_and_temperature_with_units():
+    message = "Mi hijo de 2 años lleva 3 meses con tos; temperatura: 38,2 y anoche 101 F"
+    
+    mentions = scan_mentions(message)
+    
+    assert [(mention.kind, mention.value, mention.unit) for mention in mentions] == [
+        ("age", 2, "years"), ("age", 3, "months"), ("temp", 38.2, "C"), ("temp", 101, "F"),
+    ]
+    assert normalize_text(message)[mentions[1].start:mentions[1].end] == "3 meses"
+    assert Mention("age", 6, "weeks", 0, 0).normalized == 1.5
+
+
+def test_extract_age_temp_picks_patient_age_and_max_temperature():
+    assert extract_age_temp("Mi bebé de 2 meses tiene 38.5°C") == {"age_months": 2, "temp_c": 38.5}
+    assert extract_age_temp("2-month-old, 100.4 F this morning and 38.6 C now") == {"age_months": 2, "temp_c": 38.6}
+    assert extract_age_temp("bebé de 5 días con fiebre de 38") == {"age_months": 0, "temp_c": 38.0}
+    assert extract_age_temp("bebé de 2 años") == {"age_months": 24, "temp_c": None}
+    # "3 días" es una duración, no una temperatura
+    assert extract_age_temp("fiebre de 3 días, tiene 3 fiebres") == {"age_months": None, "temp_c": None}
+
+
+@pytest.mark.critical
+@pytest.mark.parametrize("message", [
+    "Su hermano de 4 años lo contagió; mi bebé de 2 meses tiene 38.3°C",
+    "My 3 year old had the flu last week, now my 2 month old has 38.4 C",
+])
+def test_infant_mentioned_after_older_sibling_is_red(message):
+    assert extract_age_temp(message)["age_months"] == 2
+    assert check_red_flags(message)[0]
+    assert classify_batch([message]) == ["ROJO"]
+
+
+def test_extract_age_temp_skips_durations_unless_no_other_age():
+    assert extract_age_temp("hijo de 3 años con tos hace 2 semanas")["age_months"] == 36
+    assert extract_age_temp("my 3 year old has had a fever for 2 weeks, 39 C") == {"age_months": 36, "temp_c": 39.0}
+    assert extract_age_temp("Mi hijo de 2 años lleva 3 meses con tos")["age_months"] == 24
+    assert extract_age_temp("mi hijo de 5 años con fiebre por 2 semanas, 38.5°C") == \
+        {"age_months": 60, "temp_c": 38.5}
+    assert extract_age_temp("hace ya 2 semanas que mi hijo de 3 años tose")["age_months"] == 36
+    # Solo duraciones: se toma la menor igual (falla hacia el lado seguro)
+    assert extract_age_temp("tiene tos hace 2 semanas")["age_months"] == 0
+
+
+def test_extract_age_temp_combines_compound_ages():
+    assert extract_age_temp("Mi bebé de 4 meses y 2 semanas tiene 38.2°C") == {"age_months": 4, "temp_c": 38.2}
+    assert check_red_flags("Mi bebé de 4 meses y 2 semanas tiene 38.2°C") == (False, "")
+    assert extract_age_temp("1 año y 6 meses")["age_months"] == 18
+    assert extract_age_temp("my son is 2 years and 3 months old")["age_months"] == 27
+    # Misma unidad: son dos niños, no una edad compuesta
+    assert extract_age_temp("mis hijos de 2 años y 3 años")["age_months"] == 24
+    assert classify_batch(["mi hijo de 5 años con fiebre por 2 semanas, 38.5°C"]) == [None]
+
+
+def test_matching_ignores_accents_and_case():
+    matcher = RedFlagMatcher(["convulsión", "convulsion", "Cuello rígido"])
+    
+    assert normalize_text("CONVULSIÓN, cuello RÍGIDO, 38º") == "convulsion, cuello rigido, 38°"
+    # Variantes con y sin tilde se compilan una sola vez y reportan la primera regla
+    assert [match.flag for match in matcher.find_all("convulsion y cuello rigido")] == ["convulsión", "Cuello rígido"]
+    assert matcher.first("Tuvo una CONVULSIÓN").flag == "convulsión"
+    assert extract_age_temp("bebe de 2 anos, 38º") == extract_age_temp("bebé de 2 años, 38°")
+    assert extract_age_temp("bebe de 2 anos, 38º") == {"age_months": 24, "temp_c": 38.0}
+
+
+def test_classify_batch_applies_age_threshold_table():
+    messages = [
+        "Mi bebé de 2 meses tiene 38.2°C",          # 0-3 meses >= 38.0
+        "bebé de 4 meses con 38.5 grados",          # 3-6 meses >= 38.3
+        "bebé de 4 meses con 39.2 grados",          # Regla AAP 3-6 meses >= 39.0: NARANJA, no emergencia
+        "hijo de 8 meses, 38.9 C",                  # 6-12 meses >= 38.9
+        "niño de 3 años con 38.5 grados",           # Bajo el umbral de >12 meses
+        "fiebre de 39 grados",                      # Sin edad: la tabla no aplica
+        "tuvo una convulsion, tiene 2 años",
+        "",
+    ]
+    
+    assert classify_batch(messages) == ["ROJO", "NARANJA", "NARANJA", "AMARILLO", None, None, "ROJO", None]
+    assert classify_batch([]) == []
+
+
+def test_classify_batch_agrees_with_single_message_red_flags():
+    messages = ["bebé de 2 meses con 38 C", "bebé de 5 meses con 39.5 C", "stiff neck", "my 3 year old has a cold"]
+    
+    levels = classify_batch(messages)
+    
+    assert [level == "ROJO" for level in levels] == [check_emergency(message)[0] for message in messages]
+    assert levels[1] == "NARANJA" and check_red_flags("bebé de 5 meses con 39.5 C")[0]
+    assert check_red_flags("bebé de 5 meses con 39.5 C", "es") == (True, "bebé 3-6 meses con fiebre alta 39.5°C")
+    assert check_red_flags("5 month old with 39.5 C") == (True, "baby 3-6 months with high fever 39.5°C")
+
+
+def test_classify_batch_follows_threshold_changes():
+    rules = copy.deepcopy(TRIAGE_RULES)
+    rules["age_thresholds"]["over_12_months"]["temp_c"] = 38.0
+    
+    assert classify_batch(["niño de 3 años con 38.5 grados"]) == [None]
+    assert RuleSet(rules).classify_batch(["niño de 3 años con 38.5 grados"]) == ["AMARILLO"]
+
+
+def write_rules(path, rules, mtime_ns):
+    path.write_text(json.dumps(rules, ensure_ascii=False), encoding="utf-8")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_rules_watcher_swaps_snapshot_when_file_changes(tmp_path):
+    rules_file = tmp_path / "triage_rules.json"
+    write_rules(rules_file, TRIAGE_RULES, 1_000_000_000)
+    watcher = RulesWatcher(rules_file, interval=0)
+    snapshot = watcher.current()
+    assert watcher.current() is snapshot  # Sin cambios no se recompila
+    
+    updated = copy.deepcopy(TRIAGE_RULES)
+    updated["red_flags"].append("labios morados")
+    write_rules(rules_file, updated, 2_000_000_000)
+    reloaded = watcher.current()
+    
+    assert reloaded is not snapshot and reloaded.version != snapshot.version
+    assert reloaded.check_red_flags("tiene los labios morados") == (True, "labios morados")
+    # Un request en curso conserva las reglas con las que empezó
+    assert snapshot.check_red_flags("tiene los labios morados") == (False, "")
+
+
+def test_rules_watcher_keeps_current_rules_when_file_is_invalid(tmp_path):
+    rules_file = tmp_path / "triage_rules.json"
+    write_rules(rules_file, TRIAGE_RULES, 1_000_000_000)
+    watcher = RulesWatcher(rules_file, interval=0)
+    snapshot = watcher.current()
+    
+    rules_file.write_text('{"red_flags": ["convulsión"', encoding="utf-8")  # A medio escribir
+    assert watcher.current() is snapshot
+    invalid = copy.deepcopy(TRIAGE_RULES)
+    invalid["age_thresholds"]["0-3_months"]["level"] = "rojo"
+    write_rules(rules_file, invalid, 3_000_000_000)
+    assert watcher.current() is snapshot
+    rules_file.unlink()
+    assert watcher.current() is snapshot
+
+
+@pytest.mark.parametrize("field, value", [
+    ("temp_c", "38"),
+    ("max_months", 0),
+    ("level", "rojo"),
+    ("flag", {"en": "baby with fever {temp}°C"}),
+    ("flag", "bebé <3 meses con fiebre {temp_c}°C"),
+])
+def test_rules_watcher_rejects_invalid_fever_rules(tmp_path, field, value):
+    rules_file = tmp_path / "triage_rules.json"
+    write_rules(rules_file, TRIAGE_RULES, 1_000_000_000)
+    watcher = RulesWatcher(rules_file, interval=0)
+    snapshot = watcher.current()
+    
+    invalid = copy.deepcopy(TRIAGE_RULES)
+    invalid["fever_red_flags"][0][field] = value
+    write_rules(rules_file, invalid, 2_000_000_000)
+    
+    assert watcher.current() is snapshot
+    assert watcher.current().check_red_flags("2 month old with 38.5 C") == \
+        (True, "baby under 3 months with fever 38.5°C")
+
+
+def test_engine_red_flags_use_hot_reloaded_rules(tmp_path, monkeypatch):
+    rules_file = tmp_path / "triage_rules.json"
+    write_rules(rules_file, TRIAGE_RULES, 1_000_000_000)
+    monkeypatch.setattr(triage, "_WATCHER", RulesWatcher(rules_file, interval=0))
+    assert check_red_flags("tiene los labios morados") == (False, "")
+    
+    updated = copy.deepcopy(TRIAGE_RULES)
+    updated["red_flags"].append("labios morados")
+    write_rules(rules_file, updated, 2_000_000_000)
+    
+    assert check_red_flags("tiene los labios morados") == (True, "labios morados")
+    assert classify_batch(["tiene los labios morados"]) == ["ROJO"]
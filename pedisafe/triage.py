@@ -0,0 +1,488 @@
+"""
+PediSafe Triage
+Capa A: reglas deterministas compiladas una sola vez y aplicadas en una pasada por mensaje
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from age_bands import band_range
+from config import TRIAGE_RULES_FILE, TRIAGE_RULES_RELOAD_SECONDS
+
+
+# Diacríticos que NFKD separa de la letra (tilde, acento, diéresis); un regex evita el bucle por carácter
+_COMBINING_RE = re.compile("[\u0300-\u036f]")
+
+
+@lru_cache(maxsize=1024)
+def normalize_text(text: str) -> str:
+    """Minúsculas sin acentos ("Convulsión" -> "convulsion", "AÑOS" -> "anos")
+    
+    Se aplica una vez por mensaje (la Capa A lo consulta varias veces por request y la
+    caché lo resuelve con un hash) y una vez por regla al compilar. Texto ASCII: solo
+    minúsculas. Con caracteres acentuados compuestos las posiciones coinciden con las
+    del mensaje original.
+    """
+    if text.isascii():
+        return text.lower()
+    # "38º" (ordinal, frecuente en teclados en español) se lee como grados: NFKD lo convertiría en "o"
+    return _COMBINING_RE.sub("", unicodedata.normalize("NFKD", text.replace("º", "°")).casefold())
+
+
+class FlagMatch(NamedTuple):
+    """Señal de alarma encontrada: texto de la regla y posición en el mensaje normalizado"""
+    flag: str
+    start: int
+    end: int
+
+
+def _trie_pattern(words: Sequence[str]) -> str:
+    """Alternación de literales como trie: los prefijos comunes se comparan una sola vez
+    
+    "no respira|no responde" -> "no\\ resp(?:ira|onde)"; en cada nodo se prueba
+    primero la rama más larga, así gana "dificultad respiratoria" sobre un prefijo.
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return _node_pattern(trie)
+
+
+def _node_pattern(node: Dict[str, dict]) -> str:
+    branches = [re.escape(char) + _node_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if "" in node:
+        return f"(?:{body})?"
+    return body
+
+
+class RedFlagMatcher:
+    """Todas las señales de alarma de una lista compiladas en una sola expresión regular
+    
+    Un mensaje se recorre una vez sin importar cuántos sinónimos haya (el bucle
+    `flag in mensaje` era O(señales × largo)). Reglas y mensaje se comparan normalizados
+    (normalize_text): "convulsion" escrito sin tilde también es una señal, sin agregar
+    variantes al archivo de reglas.
+    """
+    
+    def __init__(self, flags: Sequence[str]):
+        self.flags = tuple(flags)
+        # Regla normalizada -> (regla original, prioridad); "convulsión" y "convulsion"
+        # quedan en una sola entrada y gana la primera de la lista
+        self._rules: Dict[str, Tuple[str, int]] = {}
+        for rank, flag in enumerate(self.flags):
+            key = normalize_text(flag)
+            if key and key not in self._rules:
+                self._rules[key] = (flag, rank)
+        self._pattern = re.compile(_trie_pattern(list(self._rules))) if self._rules else None
+    
+    def _matches(self, text: str):
+        if self._pattern is None:
+            return []
+        return [(self._rules[match.group()], match) for match in self._pattern.finditer(normalize_text(text))]
+    
+    def find_all(self, text: str) -> List[FlagMatch]:
+        """Señales encontradas en orden de aparición (sin solapamiento, la más larga en cada posición)"""
+        return [FlagMatch(flag, match.start(), match.end()) for (flag, _), match in self._matches(text)]
+    
+    def first(self, text: str) -> Optional[FlagMatch]:
+        """Señal de mayor prioridad (la primera de la lista de reglas) presente en el texto"""
+        matches = self._matches(text)
+        if not matches:
+            return None
+        (flag, _), match = min(matches, key=lambda item: item[0][1])
+        return FlagMatch(flag, match.start(), match.end())
+
+
+class Mention(NamedTuple):
+    """Edad o temperatura mencionada en el mensaje, en la unidad escrita"""
+    kind: str       # "age" | "temp"
+    value: float
+    unit: str       # "days", "weeks", "months", "years" | "C", "F"
+    start: int
+    end: int
+    
+    @property
+    def normalized(self) -> float:
+        """Edad en meses o temperatura en °C"""
+        if self.kind == "age":
+            return self.value * _MONTHS_PER_UNIT[self.unit]
+        if self.unit == "F":
+            return (self.value - 32) * 5 / 9
+        return self.value
+
+
+_MONTHS_PER_UNIT = {"days": 1 / 30, "weeks": 0.25, "months": 1, "years": 12}
+_AGE_UNITS = (("d", "days"), ("semana", "weeks"), ("week", "weeks"), ("mes", "months"), ("month", "months"),
+              ("a", "years"), ("year", "years"))
+# Fuera de este rango (ya en °C) un número no es una temperatura corporal
+_PLAUSIBLE_TEMP_C = (30.0, 45.0)
+
+_NUMBER = r"\d+(?:[.,]\d+)?"
+_AGE_UNIT = r"meses|mes|months?|anos?|years?|semanas?|weeks?"
+_TEMP_UNIT = r"celsius|centigrados|fahrenheit|c|f"
+_END = r"(?![a-z])"
+
+# Sobre el texto normalizado: "años"/"anos", "días"/"dias" y "bebé"/"bebe" son la misma forma.
+# Una sola expresión con todas las formas; finditer recorre el mensaje una vez. El lookahead
+# inicial descarta en una comparación las posiciones que no pueden empezar una mención
+_MENTION_RE = re.compile(
+    r"(?=[btf\d])(?:"
+    # "bebé de 2" (sin unidad = meses), "bebé de 5 días", "bebé de 2 años"
+    rf"bebe?\s+de\s+(?P<baby>{_NUMBER})(?:\s*-?\s*(?P<baby_unit>{_AGE_UNIT}|dias?|days?){_END})?"
+    # "8 meses", "3 years", "2-month-old"
+    rf"|(?P<age>{_NUMBER})\s*-?\s*(?P<age_unit>{_AGE_UNIT}){_END}"
+    # "temperatura: 38.5", "fiebre de 39 grados", "fever of 101"
+    rf"|(?:temp\w*|fiebre|fever)\s*:?\s*(?:de\s+|of\s+)?(?P<keyword>\d{{2,3}}(?:[.,]\d+)?)"
+    rf"(?:\s*(?:°|grados?)?\s*(?P<keyword_unit>{_TEMP_UNIT}){_END})?"
+    # "38.5°C", "38,5 grados", "101 F", "38°"
+    rf"|(?P<temp>{_NUMBER})\s*(?:(?:°|grados?)\s*(?:(?P<temp_unit>{_TEMP_UNIT}){_END})?"
+    rf"|(?P<letter_unit>{_TEMP_UNIT}){_END}))"
+)
+
+
+def _age_unit(token: Optional[str]) -> str:
+    if not token:
+        return "months"
+    for prefix, unit in _AGE_UNITS:
+        if token.startswith(prefix):
+            return unit
+    return "months"
+
+
+def _number(text: str) -> float:
+    return float(text.replace(",", "."))
+
+
+def _temp_mention(value: float, unit: Optional[str], start: int, end: int) -> Optional[Mention]:
+    # Sin unidad explícita, más de 45 solo puede ser Fahrenheit
+    unit = "F" if (unit and unit.startswith("f")) or (not unit and value > 45) else "C"
+    mention = Mention("temp", value, unit, start, end)
+    low, high = _PLAUSIBLE_TEMP_C
+    return mention if low <= mention.normalized <= high else None
+
+
+def scan_mentions(message: str) -> List[Mention]:
+    """Todas las edades y temperaturas del mensaje (posiciones sobre el texto normalizado), en una pasada"""
+    mentions = []
+    for match in _MENTION_RE.finditer(normalize_text(message)):
+        baby, baby_unit, age, age_unit, keyword, keyword_unit, temp, temp_unit, letter_unit = match.groups()
+        start, end = match.span()
+        if baby is not None:
+            mentions.append(Mention("age", _number(baby), _age_unit(baby_unit), start, end))
+        elif age is not None:
+            mentions.append(Mention("age", _number(age), _age_unit(age_unit), start, end))
+        else:
+            value, unit = (keyword, keyword_unit) if keyword is not None else (temp, temp_unit or letter_unit)
+            mention = _temp_mention(_number(value), unit, start, end)
+            if mention is not None:
+                mentions.append(mention)
+    return mentions
+
+
+# "hace 2 semanas", "hace ya 3 días que", "por 2 semanas", "lleva 3 meses", "for 2 weeks",
+# "2 weeks ago": duración, no edad del paciente
+_DURATION_BEFORE_RE = re.compile(
+    r"\b(?:hace|desde|durante|por|lleva|llevamos|for|since|past)\s+"
+    r"(?:(?:ya|casi|unos?|unas?|mas de|about|almost|over|the past)\s+)?$"
+)
+_DURATION_AFTER_RE = re.compile(r"\s*(?:ago|atras)\b")
+# "1 año y 6 meses", "4 meses y 2 semanas", "2 years, 3 months": una sola edad
+_COMPOUND_GAP_RE = re.compile(r"\s*(?:,\s*)?(?:y|and|,)\s*")
+
+
+def _is_duration(text: str, mention: Mention) -> bool:
+    return bool(_DURATION_BEFORE_RE.search(text, max(0, mention.start - 24), mention.start)
+                or _DURATION_AFTER_RE.match(text, mention.end))
+
+
+def _combine_compound_ages(text: str, ages: List[Mention]) -> List[Mention]:
+    """Une "X años y Y meses" (unidad menor a continuación) en una mención en meses"""
+    combined = [ages[0]]
+    for mention in ages[1:]:
+        previous = combined[-1]
+        if (_MONTHS_PER_UNIT[mention.unit] < _MONTHS_PER_UNIT[previous.unit]
+                and _COMPOUND_GAP_RE.fullmatch(text, previous.end, mention.start)):
+            combined[-1] = Mention("age", previous.normalized + mention.normalized, "months",
+                                   previous.start, mention.end)
+        else:
+            combined.append(mention)
+    return combined
+
+
+def extract_age_temp(message: str) -> Dict[str, Optional[float]]:
+    """Edad (meses) y temperatura (°C) clínicamente relevantes del mensaje
+    
+    Con varias edades ("su hermano de 4 años...; mi bebé de 2 meses") se toma la menor:
+    los umbrales son más estrictos cuanto menor es la edad, así que equivocarse de niño
+    nunca baja el nivel. Una edad compuesta ("1 año y 6 meses") cuenta como una sola; las
+    que se leen como duración ("hace 2 semanas") solo cuentan si no hay otra. La
+    temperatura es la máxima, la que decide el triage.
+    """
+    mentions = scan_mentions(message)
+    ages = [mention for mention in mentions if mention.kind == "age"]
+    if len(ages) > 1:
+        text = normalize_text(message)
+        ages = _combine_compound_ages(text, ages)
+        ages = [mention for mention in ages if not _is_duration(text, mention)] or ages
+    temps = [mention.normalized for mention in mentions if mention.kind == "temp"]
+    return {
+        "age_months": int(min(mention.normalized for mention in ages)) if ages else None,
+        "temp_c": round(max(temps), 1) if temps else None,
+    }
+
+
+LEVELS = ("ROJO", "NARANJA", "AMARILLO", "VERDE")
+
+
+class FeverRule(NamedTuple):
+    """Fiebre que es señal de alarma en un rango de edad aunque la tabla por edad diga otra cosa
+    
+    `level` es el nivel mínimo que impone: solo las reglas ROJO van a la ruta rápida de
+    emergencia; las demás alertan al LLM.
+    """
+    min_months: float
+    max_months: float
+    temp_c: float
+    level: str
+    flag: Dict[str, str]    # Señal reportada por idioma ("en", "es"); {temp_c} se reemplaza por la temperatura
+    
+    def text(self, temp_c: float, language: str = "en") -> str:
+        """Señal en el idioma de la respuesta (inglés si no está traducida, como get_text)"""
+        return self.flag.get(language, self.flag["en"]).format(temp_c=temp_c)
+
+
+class ThresholdTable:
+    """age_thresholds y reglas de fiebre como arreglos ordenados por edad para búsquedas vectorizadas"""
+    
+    def __init__(self, age_thresholds: Dict[str, dict], fever_rules: Sequence[FeverRule] = ()):
+        bands = sorted(age_thresholds, key=lambda band: band_range(band)[0])
+        self.lows = np.array([band_range(band)[0] for band in bands])
+        self.temps = np.array([float(age_thresholds[band]["temp_c"]) for band in bands])
+        # Niveles como rango de gravedad (0 = ROJO); len(LEVELS) = sin hallazgo
+        self.ranks = np.array([LEVELS.index(age_thresholds[band]["level"]) for band in bands])
+        self.fever_lows = np.array([rule.min_months for rule in fever_rules], dtype=float)
+        self.fever_highs = np.array([rule.max_months for rule in fever_rules], dtype=float)
+        self.fever_temps = np.array([rule.temp_c for rule in fever_rules], dtype=float)
+        self.fever_ranks = np.array([LEVELS.index(rule.level) for rule in fever_rules], dtype=int)
+    
+    def classify(self, ages: np.ndarray, temps: np.ndarray, red_flags: np.ndarray) -> np.ndarray:
+        """Nivel por fila (None = sin hallazgo determinista); edades/temperaturas faltantes en NaN"""
+        band = np.clip(np.searchsorted(self.lows, ages, side="right") - 1, 0, len(self.lows) - 1)
+        # Sin edad o sin temperatura (NaN) no se aplica la tabla
+        fever = ~np.isnan(ages) & (temps >= self.temps[band])
+        ranks = np.where(fever, self.ranks[band], len(LEVELS))
+        # Las reglas de fiebre solo suben el nivel: gana el más grave
+        fever_hits = ((ages[:, None] >= self.fever_lows) & (ages[:, None] < self.fever_highs)
+                      & (temps[:, None] >= self.fever_temps))
+        ranks = np.minimum(ranks, np.where(fever_hits, self.fever_ranks, len(LEVELS)).min(axis=1, initial=len(LEVELS)))
+        ranks[red_flags] = 0
+        return np.array(LEVELS + (None,), dtype=object)[ranks]
+
+
+def _validate(rules: dict):
+    """Errores de tipeo que si no pasarían en silencio (un nivel mal escrito, una banda sin edad)"""
+    flags = rules.get("red_flags")
+    if not isinstance(flags, list) or not all(isinstance(flag, str) for flag in flags):
+        raise ValueError("red_flags debe ser una lista de textos")
+    thresholds = rules.get("age_thresholds")
+    if not isinstance(thresholds, dict) or not thresholds:
+        raise ValueError("age_thresholds debe tener al menos una banda")
+    for band, rule in thresholds.items():
+        if not re.search(r"\d", band):
+            raise ValueError(f"La banda {band!r} no indica edades")
+        if rule.get("level") not in LEVELS or not isinstance(rule.get("temp_c"), (int, float)):
+            raise ValueError(f"Regla inválida para {band!r}: {rule}")
+    if min(band_range(band)[0] for band in thresholds) != 0:
+        raise ValueError("La primera banda de age_thresholds debe empezar en 0 meses")
+    fever_rules = rules.get("fever_red_flags", [])
+    if not isinstance(fever_rules, list):
+        raise ValueError("fever_red_flags debe ser una lista de reglas")
+    for rule in fever_rules:
+        _validate_fever_rule(rule)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _validate_fever_rule(rule):
+    """Una regla de fiebre rota fallaría recién al llegar el mensaje que la dispara"""
+    if not isinstance(rule, dict) or set(rule) != set(FeverRule._fields):
+        raise ValueError(f"Regla de fiebre inválida (campos {', '.join(FeverRule._fields)}): {rule}")
+    if not all(_is_number(rule[field]) for field in ("min_months", "max_months", "temp_c")):
+        raise ValueError(f"min_months, max_months y temp_c deben ser números: {rule}")
+    if not 0 <= rule["min_months"] < rule["max_months"]:
+        raise ValueError(f"Rango de edad vacío en la regla de fiebre: {rule}")
+    if rule["level"] not in LEVELS:
+        raise ValueError(f"level debe ser uno de {', '.join(LEVELS)}: {rule}")
+    flag = rule["flag"]
+    if not isinstance(flag, dict) or "en" not in flag or not all(isinstance(text, str) for text in flag.values()):
+        raise ValueError(f"flag debe tener el texto por idioma (al menos 'en'): {rule}")
+    for text in flag.values():
+        try:
+            text.format(temp_c=0.0)
+        except (KeyError, IndexError, ValueError) as e:
+            raise ValueError(f"flag {text!r} solo puede usar {{temp_c}}: {e!r}") from None
+
+
+class RuleSet:
+    """Reglas de la Capa A compiladas: matcher de señales + tabla de decisión por edad
+    
+    Inmutable: un request (o un lote) toma el RuleSet vigente al empezar y lo usa hasta
+    el final aunque el archivo de reglas se recargue mientras tanto.
+    """
+    
+    def __init__(self, rules: dict, version: str = ""):
+        _validate(rules)
+        self.version = version
+        self.matcher = RedFlagMatcher(rules["red_flags"])
+        self.fever_rules = tuple(FeverRule(**rule) for rule in rules.get("fever_red_flags", []))
+        self.table = ThresholdTable(rules["age_thresholds"], self.fever_rules)
+    
+    def check_red_flags(self, message: str, language: str = "en") -> Tuple[bool, str]:
+        """Capa A: Verificación determinista de señales de alarma
+        
+        Las señales de fiebre se redactan en `language`; las textuales se reportan tal como
+        están en la lista de reglas.
+        """
+        return self._find_flag(message, language, LEVELS)
+    
+    def check_emergency(self, message: str, language: str = "en") -> Tuple[bool, str]:
+        """Solo señales de nivel ROJO: las que se responden sin LLM (ruta rápida)
+        
+        Una regla de fiebre NARANJA (3-6 meses >= 39 °C) sigue alertando al LLM vía
+        check_red_flags, pero no dispara la tarjeta de emergencia.
+        """
+        return self._find_flag(message, language, ("ROJO",))
+    
+    def _find_flag(self, message: str, language: str, levels: Sequence[str]) -> Tuple[bool, str]:
+        # CRÍTICO: Verificar edad + fiebre ANTES de buscar red flags textuales
+        age_temp = extract_age_temp(message)
+        age_months, temp_c = age_temp["age_months"], age_temp["temp_c"]
+        if age_months is not None and temp_c is not None:
+            for rule in self.fever_rules:
+                if (rule.level in levels and rule.min_months <= age_months < rule.max_months
+                        and temp_c >= rule.temp_c):
+                    return True, rule.text(temp_c, language)
+        
+        # Buscar red flags textuales (síntomas críticos) en una sola pasada
+        match = self.matcher.first(message)
+        if match is not None:
+            return True, match.flag
+        return False, ""
+    
+    def classify_batch(self, messages: Sequence[str]) -> List[Optional[str]]:
+        """Nivel determinista (ROJO/NARANJA/AMARILLO) de muchos mensajes sin LLM (auditorías)
+        
+        ROJO si hay una señal de alarma textual; si no, el más grave entre el nivel de la banda
+        etaria (si la temperatura alcanza su umbral) y el de las reglas de fiebre AAP que
+        apliquen, igual que check_emergency. None: la Capa A no decide, hace
+        falta la Capa B. El texto se recorre una vez por mensaje; las reglas de edad y
+        temperatura se aplican a todo el lote con NumPy.
+        """
+        ages = np.full(len(messages), np.nan)
+        temps = np.full(len(messages), np.nan)
+        red_flags = np.zeros(len(messages), dtype=bool)
+        for row, message in enumerate(messages):
+            age_temp = extract_age_temp(message)
+            if age_temp["age_months"] is not None:
+                ages[row] = age_temp["age_months"]
+            if age_temp["temp_c"] is not None:
+                temps[row] = age_temp["temp_c"]
+            red_flags[row] = self.matcher.first(message) is not None
+        return self.table.classify(ages, temps, red_flags).tolist()
+
+
+class RulesWatcher:
+    """Archivo de reglas recargado en caliente
+    
+    current() mira el archivo (un stat) como mucho cada `interval` segundos; si cambió,
+    lo recompila y publica el nuevo RuleSet con una sola asignación, así los lectores
+    nunca ven reglas a medio compilar. Un archivo inválido o a medio escribir no
+    reemplaza las reglas vigentes.
+    """
+    
+    def __init__(self, path: Path, interval: float = 2.0):
+        self.path = Path(path)
+        self.interval = interval
+        self._lock = threading.Lock()
+        # Al arrancar las reglas tienen que ser válidas: sin ellas no hay Capa A
+        self._stamp = self._file_stamp()
+        self._rules = self._compile()
+        self._next_check = time.monotonic() + interval
+    
+    def _file_stamp(self) -> Tuple[int, int]:
+        stat = self.path.stat()
+        return stat.st_mtime_ns, stat.st_size
+    
+    def _compile(self) -> RuleSet:
+        content = self.path.read_bytes()
+        return RuleSet(json.loads(content), version=hashlib.sha256(content).hexdigest()[:12])
+    
+    def current(self) -> RuleSet:
+        if time.monotonic() >= self._next_check:
+            self._reload_if_changed()
+        return self._rules
+    
+    def _reload_if_changed(self):
+        # Un solo hilo revisa; el resto sigue con las reglas vigentes sin esperar
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = time.monotonic() + self.interval
+            try:
+                stamp = self._file_stamp()
+                if stamp == self._stamp:
+                    return
+                rules = self._compile()
+            except Exception as e:
+                print(f"⚠️ Reglas de triage inválidas en {self.path}, se mantienen las vigentes: {e}")
+                return
+            self._rules, self._stamp = rules, stamp
+            print(f"🔄 Reglas de triage recargadas (versión {rules.version}, {len(rules.matcher.flags)} señales)")
+        finally:
+            self._lock.release()
+
+
+_WATCHER: Optional[RulesWatcher] = None
+_WATCHER_LOCK = threading.Lock()
+
+
+def current_rules() -> RuleSet:
+    """Snapshot vigente de las reglas de TRIAGE_RULES_FILE"""
+    global _WATCHER
+    if _WATCHER is None:
+        with _WATCHER_LOCK:
+            if _WATCHER is None:
+                _WATCHER = RulesWatcher(TRIAGE_RULES_FILE, TRIAGE_RULES_RELOAD_SECONDS)
+    return _WATCHER.current()
+
+
+def check_red_flags(message: str, language: str = "en") -> Tuple[bool, str]:
+    """Capa A con el snapshot vigente de las reglas"""
+    return current_rules().check_red_flags(message, language)
+
+
+def check_emergency(message: str, language: str = "en") -> Tuple[bool, str]:
+    """check_emergency con el snapshot vigente de las reglas"""
+    return current_rules().check_emergency(message, language)
+
+
+def classify_batch(messages: Sequence[str]) -> List[Optional[str]]:
+    """classify_batch con el snapshot vigente: todo el lote se clasifica con las mismas reglas"""
+    return current_rules().classify_batch(messages)